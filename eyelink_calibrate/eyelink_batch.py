@@ -0,0 +1,209 @@
+"""
+This file is part of OpenSesame.
+
+OpenSesame is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+OpenSesame is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with OpenSesame.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Converts all sessions of a study in one go. Every ASC file in a directory (and
+every EDF file without an ASC file, if edf2asc is available) is parsed with
+libasc, split into trials, and summarized per trial, on a pool of processes.
+The result of each session is cached by the MD5 checksum of its file, so that
+sessions that have not changed are not parsed again. All sessions are then
+written to a single npz file (see libasc.save_npz()), in which every table has
+an additional session column, and a sessions table lists the files.
+
+Usage:
+python eyelink_batch.py [--output study.npz] [--jobs N] [--samples] \
+	[--cache DIR] [directory]
+"""
+
+import os
+import sys
+import glob
+import hashlib
+import argparse
+import subprocess
+import multiprocessing
+from distutils.spawn import find_executable
+import numpy as np
+import libasc
+
+# Increase when the parser or the features change, to invalidate the cache
+CACHE_VERSION = 1
+
+def checksum(path):
+
+	"""
+	Arguments:
+	path -- the path of a file
+
+	Returns:
+	The MD5 checksum of the cache version and the file contents
+	"""
+
+	md5 = hashlib.md5(b'%d\n' % CACHE_VERSION)
+	with open(path, u'rb') as fd:
+		for block in iter(lambda: fd.read(1 << 20), b''):
+			md5.update(block)
+	return md5.hexdigest()
+
+def process_session(args):
+
+	"""
+	Parses a session, unless it is in the cache. This runs in a worker #
+	process.
+
+	Arguments:
+	args -- a (path, cache_dir) tuple. The path is an ASC or EDF file.
+
+	Returns:
+	A (path, checksum, cache_path, cached, error) tuple
+	"""
+
+	path, cache_dir = args
+	try:
+		md5 = checksum(path)
+		cache_path = os.path.join(cache_dir, md5 + u'.npz')
+		if os.path.exists(cache_path):
+			return path, md5, cache_path, True, None
+		asc_path = path
+		if path.lower().endswith(u'.edf'):
+			subprocess.check_call([u'edf2asc', u'-y', path], \
+				stdout=open(os.devnull, u'w'))
+			asc_path = os.path.splitext(path)[0] + u'.asc'
+		tables = libasc.parse_asc(asc_path)
+		tables[u'features'] = libasc.trial_features(tables)
+		# Write under a temporary name, so that an interrupted run does not
+		# leave a broken cache entry. Sessions with identical contents share a
+		# cache entry, so the name is unique per worker.
+		tmp_path = u'%s.%d.tmp.npz' % (cache_path, os.getpid())
+		libasc.save_npz(tables, tmp_path)
+		try:
+			os.rename(tmp_path, cache_path)
+		except OSError:
+			# Another worker may have written the same entry first
+			os.remove(tmp_path)
+			if not os.path.exists(cache_path):
+				raise
+		return path, md5, cache_path, False, None
+	except Exception as e:
+		return path, None, None, False, u'%s' % e
+
+def find_sessions(directory):
+
+	"""
+	Arguments:
+	directory -- the study directory
+
+	Returns:
+	A sorted list of ASC files, and of EDF files that have no ASC file if #
+	edf2asc is available
+	"""
+
+	sessions = glob.glob(os.path.join(directory, u'*.asc'))
+	if find_executable(u'edf2asc') != None:
+		for path in glob.glob(os.path.join(directory, u'*.edf')):
+			if os.path.splitext(path)[0] + u'.asc' not in sessions:
+				sessions.append(path)
+	return sorted(sessions)
+
+def consolidate(results, include_samples=False):
+
+	"""
+	Combines the cached results of all sessions
+
+	Arguments:
+	results -- a list of (path, checksum, cache_path) tuples
+
+	Keyword arguments:
+	include_samples -- indicates whether the samples are included #
+					   (default=False)
+
+	Returns:
+	A dict of tables
+	"""
+
+	study = {}
+	for session, (path, md5, cache_path) in enumerate(results):
+		tables = libasc.load_npz(cache_path)
+		if not include_samples:
+			del tables[u'samples']
+		for table, columns in tables.items():
+			n = len(columns.values()[0])
+			columns[u'session'] = np.full(n, session, dtype=np.int32)
+			study.setdefault(table, []).append(columns)
+	study = dict([(table, libasc.concatenate(tables)) for table, tables \
+		in study.items()])
+	study[u'sessions'] = {
+		u'session' : np.arange(len(results), dtype=np.int32),
+		u'path' : np.array([path for path, md5, cache_path in results], \
+			dtype=np.unicode_),
+		u'md5' : np.array([md5 for path, md5, cache_path in results], \
+			dtype=np.unicode_)
+		}
+	return study
+
+def main():
+
+	"""Converts a study"""
+
+	parser = argparse.ArgumentParser(description= \
+		u'Converts all eye-tracking sessions of a study')
+	parser.add_argument(u'directory', nargs=u'?', default=u'.', help= \
+		u'the directory with the ASC/EDF files (default=.)')
+	parser.add_argument(u'--output', default=u'study.npz', help= \
+		u'the consolidated dataset (default=study.npz)')
+	parser.add_argument(u'--jobs', type=int, default=None, help= \
+		u'the number of worker processes (default=number of CPUs)')
+	parser.add_argument(u'--samples', action=u'store_true', help= \
+		u'include the samples in the dataset')
+	parser.add_argument(u'--cache', default=None, help= \
+		u'the cache directory (default=[directory]/.eyelink_cache)')
+	args = parser.parse_args()
+
+	cache_dir = args.cache if args.cache != None else os.path.join( \
+		args.directory, u'.eyelink_cache')
+	if not os.path.exists(cache_dir):
+		os.makedirs(cache_dir)
+	sessions = find_sessions(args.directory)
+	print u'eyelink_batch: %d sessions in %s' % (len(sessions), \
+		args.directory)
+	pool = multiprocessing.Pool(args.jobs)
+	results = {}
+	failed = 0
+	for i, (path, md5, cache_path, cached, error) in enumerate( \
+		pool.imap_unordered(process_session, [(path, cache_dir) for path \
+		in sessions])):
+		if error != None:
+			print u'[%d/%d] %s: failed: %s' % (i + 1, len(sessions), path, \
+				error)
+			failed += 1
+			continue
+		print u'[%d/%d] %s: %s' % (i + 1, len(sessions), path, \
+			u'cached' if cached else u'parsed')
+		results[path] = md5, cache_path
+	pool.close()
+	pool.join()
+	# Sessions are numbered in the order of their file names, regardless of
+	# the order in which they were finished
+	study = consolidate([(path,) + results[path] for path in sessions \
+		if path in results], include_samples=args.samples)
+	libasc.save_npz(study, args.output)
+	print u'eyelink_batch: wrote %s (%d sessions, %d failed)' % \
+		(args.output, len(results), failed)
+	return 1 if failed > 0 else 0
+
+if __name__ == u'__main__':
+	sys.exit(main())
@@ -19,8 +19,49 @@ from libopensesame import item, exceptions, debug
 from libqtopensesame import qtplugin
 import os.path
 import imp
+import sys
 from PyQt4 import QtGui, QtCore
 
+def load_module(name):
+
+	"""
+	Dynamically loads a module that is located in the plug-in folder. The #
+	module is executed only once per process, and again only if the file has #
+	changed on disk, so that preparing the plug-in repeatedly is cheap and all #
+	items share the same classes.
+
+	Arguments:
+	name -- the name of the module
+
+	Returns:
+	The module.
+	"""
+
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+		name + u'.py')
+	load_info = path, os.path.getmtime(path)
+	module = sys.modules.get(name)
+	if module != None and getattr(module, u'_load_info', None) == load_info:
+		return module
+	debug.msg(u'loading %s from %s' % (name, path))
+	# libeyelink imports helper modules from the plug-in folder
+	if os.path.dirname(path) not in sys.path:
+		sys.path.append(os.path.dirname(path))
+	module = imp.load_source(name, path)
+	module._load_info = load_info
+	return module
+
+def load_libeyelink():
+
+	"""
+	Loads libeyelink. See load_module().
+
+	Returns:
+	The libeyelink module.
+	"""
+
+	return load_module(u'libeyelink')
+
 class eyelink_calibrate(item.item):
 
 	"""
@@ -48,12 +89,56 @@ class eyelink_calibrate(item.item):
 		# Default values
 		self._text_attached = u'Yes'
 		self._text_not_attached = u'No (dummy mode)'
+		self._mode_per_trial = u'Per trial'
+		self._mode_continuous = u'Continuous (only mark trials)'
+		self._link_profiles = {
+			u'Gaze only' : u'gaze',
+			u'Gaze and pupil size' : u'gaze+pupil',
+			u'Full' : u'full'
+			}
 		self.tracker_attached = self._text_attached
 		self.sacc_vel_thresh = 35
 		self.sacc_acc_thresh = 9500
 		self.cal_target_size = 16
 		self.cal_beep = u'yes'
 		self.force_drift_correct = u'no'
+		self.link_data = u'Full'
+		self.recording_mode = self._mode_per_trial
+		self.defer_transfer = u'no'
+		self.mirror_link_data = u'no'
+		self.drift_estimation = u'no'
+		# The fields that can be stored in the EDF file, as (field, label,
+		# default) tuples. Each field is controlled by an edf_sample_[field] or
+		# edf_event_[field] variable.
+		self._edf_sample_fields = [
+			(u'GAZE', u'gaze position', u'yes'),
+			(u'AREA', u'pupil size', u'yes'),
+			(u'GAZERES', u'gaze resolution', u'yes'),
+			(u'STATUS', u'status flags', u'yes'),
+			(u'HTARGET', u'head target (if supported)', u'yes'),
+			(u'HREF', u'head-referenced position', u'no'),
+			(u'PUPIL', u'raw pupil position', u'no'),
+			(u'INPUT', u'input port', u'no')
+			]
+		self._edf_event_fields = [
+			(u'FIXATION', u'fixations', u'yes'),
+			(u'SACCADE', u'saccades', u'yes'),
+			(u'BLINK', u'blinks', u'yes'),
+			(u'MESSAGE', u'messages', u'yes'),
+			(u'BUTTON', u'button presses', u'yes'),
+			(u'INPUT', u'input port changes', u'no')
+			]
+		for field, label, default in self._edf_sample_fields:
+			setattr(self, u'edf_sample_%s' % field.lower(), default)
+		for field, label, default in self._edf_event_fields:
+			setattr(self, u'edf_event_%s' % field.lower(), default)
+		self.edf_sample_rate = 1000
+		self.auto_pacing = u'no'
+		self.cal_pacing = 1000
+		self.max_validation_error = 0.5
+		self.reuse_calibration = u'no'
+		self.participant = u'[subject_nr]'
+		self.max_profile_age = 60
 
 		# The parent handles the rest of the contruction
 		item.item.__init__(self, name, experiment, string)
@@ -65,13 +150,12 @@ class eyelink_calibrate(item.item):
 		item.item.prepare(self)
 		# Create an eyelink instance if it doesn't exist yet. Libeyelink is
 		# dynamically loaded
-		path = os.path.join(os.path.dirname(__file__), u'libeyelink.py')
-		libeyelink = imp.load_source(u'libeyelink', path)
+		libeyelink = load_libeyelink()
 
 		if self.get(u'tracker_attached') == self._text_attached:
 			# The edf logfile has the same name as the opensesame log, but with
 			# a different extension We also filter out characters that are not
-			# supported.
+			# supported. eyelink_merge.data_file_name() must match this.
 			data_file = u''
 			for c in os.path.splitext(os.path.basename(self.get( \
 				u'logfile')))[0]:
@@ -84,6 +168,22 @@ class eyelink_calibrate(item.item):
 			if data_file == u'defaultlog.edf':
 				data_file = u'default.edf'
 
+			# Deferred transfers are listed in a manifest next to the logfile
+			if self.get(u'defer_transfer') == u'yes':
+				pending_manifest = os.path.join(os.path.dirname( \
+					os.path.abspath(self.get(u'logfile'))), \
+					u'eyelink_pending.json')
+			else:
+				pending_manifest = None
+			# The link mirror has the same name as the EDF file, but with an
+			# .elm extension, and is stored next to the logfile
+			if self.get(u'mirror_link_data') == u'yes':
+				mirror_file = os.path.join(os.path.dirname(os.path.abspath( \
+					self.get(u'logfile'))), os.path.splitext(data_file)[0] + \
+					u'.elm')
+			else:
+				mirror_file = None
+
 			print u'eyelink_calibrate(): logging tracker data as %s' % data_file
 			debug.msg(u'loading libeyelink')
 			self.experiment.eyelink = libeyelink.libeyelink(self.experiment, \
@@ -91,7 +191,14 @@ class eyelink_calibrate(item.item):
 				data_file, saccade_velocity_threshold=self.get( \
 				u'sacc_vel_thresh'), saccade_acceleration_threshold=self.get( \
 				u'sacc_acc_thresh'), force_drift_correct=self.get( \
-				u'force_drift_correct')== u'yes')
+				u'force_drift_correct')== u'yes', link_profile= \
+				self._link_profiles[self.get(u'link_data')], \
+				file_sample_data=self.edf_fields(self._edf_sample_fields, \
+				u'edf_sample_'), file_event_filter=self.edf_fields( \
+				self._edf_event_fields, u'edf_event_'), continuous_recording= \
+				self.get(u'recording_mode') == self._mode_continuous, \
+				pending_manifest=pending_manifest, mirror_file=mirror_file, \
+				drift_estimation=self.get(u'drift_estimation') == u'yes')
 
 			self.experiment.cleanup_functions.append(self.close)
 		else:
@@ -101,6 +208,23 @@ class eyelink_calibrate(item.item):
 		# Report success DEPRECATED IN 0.27.2+
 		return True
 
+	def edf_fields(self, fields, prefix):
+
+		"""
+		Gets the selected EDF fields.
+
+		Arguments:
+		fields		--	A list of (field, label, default) tuples.
+		prefix		--	The prefix of the variables that indicate whether a #
+						field is selected.
+
+		Returns:
+		A comma-separated list of fields.
+		"""
+
+		return u','.join([field for field, label, default in fields \
+			if self.get(prefix + field.lower()) == u'yes'])
+
 	def close(self):
 
 		"""
@@ -123,8 +247,21 @@ class eyelink_calibrate(item.item):
 		"""
 
 		self.set_item_onset()
+		# Calibration profiles are stored alongside the logfile
+		if self.get(u'reuse_calibration') == u'yes':
+			participant = self.eval_text(self.get(u'participant'))
+			profile_file = os.path.join(os.path.dirname(os.path.abspath( \
+				self.get(u'logfile'))), u'eyelink_profiles.json')
+		else:
+			participant = None
+			profile_file = None
 		self.experiment.eyelink.calibrate(beep=self.get(u'cal_beep')== \
-			u'yes', target_size=self.get(u'cal_target_size'))
+			u'yes', target_size=self.get(u'cal_target_size'), auto_pacing= \
+			self.get(u'auto_pacing')==u'yes', pacing_interval=self.get( \
+			u'cal_pacing'), max_validation_error=float(self.get( \
+			u'max_validation_error')), participant=participant, \
+			profile_file=profile_file, max_profile_age=self.get( \
+			u'max_profile_age'))
 		# Report success DEPRECATED IN 0.27.2+
 		return True
 
@@ -165,18 +302,76 @@ class qteyelink_calibrate(eyelink_calibrate, qtplugin.qtplugin):
 			self.add_checkbox_control("force_drift_correct", \
 				"Enable drift correction if disabled (Eyelink 1000)", \
 				tooltip = "Indicates whether drift correction should be enabled, if it is disabled in the Eyelink configuration.")
+			self.add_checkbox_control("auto_pacing", \
+				"Auto-paced calibration", \
+				tooltip = "Indicates whether targets are accepted automatically, validation follows calibration, and set-up is left when validation is good enough")
+			self.add_checkbox_control("reuse_calibration", \
+				"Reuse recent calibration of the same participant", \
+				tooltip = "Indicates whether a recent calibration of the same participant is reused if it passes a drift check")
+			self.add_checkbox_control("defer_transfer", \
+				"Defer data-file transfer", \
+				tooltip = "Indicates whether EDF files are left on the tracker and listed in eyelink_pending.json, to be received later with eyelink_fetch.py")
+			self.add_checkbox_control("mirror_link_data", \
+				"Mirror link data to a local file", \
+				tooltip = "Indicates whether all link samples and events are written to a local .elm file while recording, which can be read with libmirror.read_mirror(). The link is only read when the experiment reads gaze data, waits for an event, or logs a message; if this does not happen for longer than the link queue holds, samples are lost, and the gaps are counted (libmirror.mirror_gaps()).")
+			self.add_checkbox_control("drift_estimation", \
+				"Online drift estimation", \
+				tooltip = "Indicates whether drift is estimated from fixations on targets that are registered with exp.eyelink.add_fixation_target(), and corrected in the gaze data")
 		else:
 			self.add_combobox_control("cal_beep", "Calibration beep", ['yes', 'no'], \
 				tooltip = "Indicates whether a beep sounds when the calibration target jumps")
 			self.add_combobox_control("force_drift_correct", \
 				"Enable drift correction if disabled (Eyelink 1000)", ['yes', 'no'], \
 				tooltip = "Indicates whether drift correction should be enabled, if it is disabled in the Eyelink configuration.")				
+			self.add_combobox_control("auto_pacing", \
+				"Auto-paced calibration", ['yes', 'no'], \
+				tooltip = "Indicates whether targets are accepted automatically, validation follows calibration, and set-up is left when validation is good enough")
+			self.add_combobox_control("reuse_calibration", \
+				"Reuse recent calibration of the same participant", ['yes', 'no'], \
+				tooltip = "Indicates whether a recent calibration of the same participant is reused if it passes a drift check")
+			self.add_combobox_control("defer_transfer", \
+				"Defer data-file transfer", ['yes', 'no'], \
+				tooltip = "Indicates whether EDF files are left on the tracker and listed in eyelink_pending.json, to be received later with eyelink_fetch.py")
+			self.add_combobox_control("mirror_link_data", \
+				"Mirror link data to a local file", ['yes', 'no'], \
+				tooltip = "Indicates whether all link samples and events are written to a local .elm file while recording, which can be read with libmirror.read_mirror(). The link is only read when the experiment reads gaze data, waits for an event, or logs a message; if this does not happen for longer than the link queue holds, samples are lost, and the gaps are counted (libmirror.mirror_gaps()).")
+			self.add_combobox_control("drift_estimation", \
+				"Online drift estimation", ['yes', 'no'], \
+				tooltip = "Indicates whether drift is estimated from fixations on targets that are registered with exp.eyelink.add_fixation_target(), and corrected in the gaze data")
+		self.add_combobox_control("recording_mode", "Recording mode", [self._mode_per_trial, self._mode_continuous], \
+			tooltip = "Indicates whether the tracker starts and stops recording for every trial, or keeps recording and only marks the start and end of trials with TRIALID and TRIAL_RESULT messages")
+		self.add_combobox_control("link_data", "Link data", [u'Gaze only', u'Gaze and pupil size', u'Full'], \
+			tooltip = "The data that is sent over the link during recording. Less data means less work per sample.")
 		self.add_spinbox_control("cal_target_size", "Calibration target size", 0, 256,
 			tooltip = "The size of the calibration target in pixels")
+		self.add_spinbox_control("cal_pacing", "Auto-pacing interval", 500, 5000, suffix = "ms", \
+			tooltip = "The minimum time between automatically accepted calibration targets")
+		self.add_line_edit_control("max_validation_error", "Maximum validation error (deg)", default = self.get("max_validation_error"), \
+			tooltip = "The maximum average validation error for auto-paced set-up to finish automatically")
+		self.add_line_edit_control("participant", "Participant ID", default = self.get("participant"), \
+			tooltip = "The participant ID under which the calibration is stored")
+		self.add_spinbox_control("max_profile_age", "Maximum age of reused calibration", 1, 1440, suffix = "min", \
+			tooltip = "The maximum age of a calibration that is reused")
 		self.add_line_edit_control("sacc_vel_thresh", "Saccade velocity threshold", default = self.get("sacc_vel_thresh"), \
 			tooltip = "Saccade detection parameter")
 		self.add_line_edit_control("sacc_acc_thresh", "Saccade acceleration threshold", default = self.get("sacc_acc_thresh"), \
 			tooltip = "Saccade detection parameter")
+		for fields, prefix, label_prefix in [
+			(self._edf_sample_fields, u'edf_sample_', u'EDF samples'),
+			(self._edf_event_fields, u'edf_event_', u'EDF events')]:
+			for field, label, default in fields:
+				if hasattr(self, 'add_checkbox_control'):
+					self.add_checkbox_control(prefix + field.lower(), \
+						u'%s: %s' % (label_prefix, label), \
+						tooltip = u'Indicates whether %s are stored in the EDF file' % label)
+				else:
+					self.add_combobox_control(prefix + field.lower(), \
+						u'%s: %s' % (label_prefix, label), ['yes', 'no'], \
+						tooltip = u'Indicates whether %s are stored in the EDF file' % label)
+		self.add_spinbox_control("edf_sample_rate", "Sample rate (for size estimate)", 250, 2000, suffix = "Hz", \
+			tooltip = "The sample rate that is used to estimate the size of the EDF file")
+		self.edf_size_label = QtGui.QLabel()
+		self.edit_vbox.addWidget(self.edf_size_label)
 		self.add_text("<small><b>Eyelink OpenSesame plug-in v%.2f</b></small>" % self.version)
 
 		# Add a stretch to the edit_vbox, so that the controls do not
@@ -192,6 +387,7 @@ class qteyelink_calibrate(eyelink_calibrate, qtplugin.qtplugin):
 
 		if not qtplugin.qtplugin.apply_edit_changes(self, False) or self.lock:
 			return False
+		self.update_edf_size()
 		self.experiment.main_window.refresh(self.name)
 		return True
 
@@ -201,6 +397,20 @@ class qteyelink_calibrate(eyelink_calibrate, qtplugin.qtplugin):
 
 		self.lock = True
 		qtplugin.qtplugin.edit_widget(self)
+		self.update_edf_size()
 		self.lock = False
 		return self._edit_widget
 
+	def update_edf_size(self):
+
+		"""Shows the estimated size of the EDF file."""
+
+		# libedf has no dependencies, so the estimate does not need libeyelink
+		mb = load_module(u'libedf').edf_bytes_per_hour(self.edf_fields( \
+			self._edf_sample_fields, u'edf_sample_'), self.edf_fields( \
+			self._edf_event_fields, u'edf_event_'), sample_rate=self.get( \
+			u'edf_sample_rate')) / 1e6
+		self.edf_size_label.setText( \
+			u'<small>Estimated EDF file size: %.0f MB per hour (monocular)</small>' \
+			% mb)
+
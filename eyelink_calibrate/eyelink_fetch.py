@@ -0,0 +1,119 @@
+"""
+This file is part of OpenSesame.
+
+OpenSesame is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+OpenSesame is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with OpenSesame.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Receives data files that were left on the tracker, because the experiment was
+run with 'Defer data-file transfer' enabled. The files to receive are read from
+the transfer manifest (eyelink_pending.json, next to the logfile), and are
+received in a single session with the tracker. Received files are moved from
+the 'pending' to the 'received' list of the manifest, together with their size
+and MD5 checksum, so that an interrupted run can simply be restarted.
+
+The tracker does not offer a way to list the files on its disk, so files that
+are not in a manifest can be given by name with --file.
+
+Usage:
+python eyelink_fetch.py [--address ADDRESS] [--retries N] [--file NAME] \
+	[manifest]
+"""
+
+import os
+import sys
+import time
+import argparse
+import libtransfer
+
+def receive(transfer):
+
+	"""
+	Runs a transfer and shows its progress on the console
+
+	Arguments:
+	transfer -- an edf_transfer object
+
+	Returns:
+	True on success, False on failure
+	"""
+
+	transfer.start()
+	while not transfer.done():
+		sys.stdout.write(u'\r%s: %.1f MB' % (transfer.src, \
+			transfer.received() / 1048576.))
+		sys.stdout.flush()
+		time.sleep(.2)
+	if transfer.success():
+		print u'\r%s: %.1f MB, md5 %s' % (transfer.src, \
+			transfer.size / 1048576., transfer.checksum)
+		return True
+	print u'\r%s: failed after %d attempts: %s' % (transfer.src, \
+		transfer.attempts, transfer.error)
+	return False
+
+def main():
+
+	"""Receives all pending data files"""
+
+	parser = argparse.ArgumentParser(description= \
+		u'Receives deferred EDF files from the EyeLink tracker')
+	parser.add_argument(u'manifest', nargs=u'?', \
+		default=u'eyelink_pending.json', help= \
+		u'the transfer manifest (default=eyelink_pending.json)')
+	parser.add_argument(u'--address', default=None, help= \
+		u'the IP address of the tracker')
+	parser.add_argument(u'--retries', type=int, default=3, help= \
+		u'the number of times that a failed transfer is repeated')
+	parser.add_argument(u'--file', action=u'append', default=[], help= \
+		u'a file on the tracker to receive in addition to the manifest')
+	args = parser.parse_args()
+
+	for src in args.file:
+		if libtransfer.is_pending(args.manifest, src):
+			continue
+		libtransfer.add_pending_file(args.manifest, src, os.path.join( \
+			os.path.dirname(os.path.abspath(args.manifest)), src))
+	manifest = libtransfer.load_manifest(args.manifest)
+	if len(manifest[u'pending']) == 0:
+		print u'eyelink_fetch: no pending data files in %s' % args.manifest
+		return 0
+
+	print u'eyelink_fetch: receiving %d data file(s)' % \
+		len(manifest[u'pending'])
+	tracker = libtransfer.connect(args.address)
+	received = 0
+	failed = 0
+	try:
+		for entry in list(manifest[u'pending']):
+			transfer = libtransfer.edf_transfer(entry[u'src'], entry[u'dest'], \
+				retries=args.retries)
+			if not receive(transfer):
+				failed += 1
+				continue
+			# Update the manifest after every file, so that nothing is
+			# received twice if the run is interrupted
+			manifest[u'pending'].remove(entry)
+			manifest[u'received'].append({u'src' : entry[u'src'], \
+				u'dest' : entry[u'dest'], u'size' : transfer.size, \
+				u'md5' : transfer.checksum, u'time' : time.time()})
+			libtransfer.save_manifest(args.manifest, manifest)
+			received += 1
+	finally:
+		tracker.close()
+	print u'eyelink_fetch: %d received, %d failed' % (received, failed)
+	return 1 if failed > 0 else 0
+
+if __name__ == u'__main__':
+	sys.exit(main())
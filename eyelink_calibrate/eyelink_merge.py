@@ -0,0 +1,274 @@
+"""
+This file is part of OpenSesame.
+
+OpenSesame is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+OpenSesame is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with OpenSesame.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Merges an OpenSesame logfile with the eye-tracking data of the same session,
+and writes one row per trial. The EDF file is found in the same way as
+eyelink_calibrate names it, and should have been converted to ASC with
+edf2asc (or parsed with libasc into an npz file).
+
+Logfile rows are matched to trials in order, or by a key variable that is both
+a logfile column and a 'var' message (written by eyelink_log or log_var()).
+All other variables that occur in both are compared, and rows in which they
+differ are flagged in the eye_mismatch column. The eye-movement summary of each
+trial (see libasc.trial_features()) is added as eye_[feature] columns.
+
+Usage:
+python eyelink_merge.py [--eye-data file.asc|file.npz] [--key VAR] \
+	[--output merged.csv] logfile.csv
+"""
+
+import os
+import sys
+import csv
+import argparse
+import numpy as np
+import libasc
+
+def data_file_name(logfile):
+
+	"""
+	Gets the name of the EDF file that eyelink_calibrate uses for a logfile. #
+	This must match eyelink_calibrate.prepare().
+
+	Arguments:
+	logfile -- the path of the OpenSesame logfile
+
+	Returns:
+	The file name of the EDF file
+	"""
+
+	data_file = u''
+	for c in os.path.splitext(os.path.basename(logfile))[0]:
+		if c.isalnum():
+			data_file += c
+	data_file = data_file + u'.edf'
+	if data_file[:8] == u'subject-':
+		data_file = u'S' + data_file[8:]
+	if data_file == u'defaultlog.edf':
+		data_file = u'default.edf'
+	return data_file
+
+def read_log(path):
+
+	"""
+	Reads an OpenSesame logfile
+
+	Arguments:
+	path -- the path of the CSV file
+
+	Returns:
+	A (header, table) tuple, in which the table is a dict of string columns
+	"""
+
+	with open(path, u'rb') as fd:
+		rows = list(csv.reader(fd))
+	header = rows[0]
+	rows = [row for row in rows[1:] if len(row) == len(header)]
+	columns = zip(*rows) if len(rows) > 0 else [()] * len(header)
+	return header, dict([(name, np.array(column, dtype=np.unicode_)) \
+		for name, column in zip(header, columns)])
+
+def variable_table(variables, trials):
+
+	"""
+	Arranges var messages as one column per variable
+
+	Arguments:
+	variables -- the variables table, see libasc
+	trials -- an array of trial numbers
+
+	Returns:
+	A dict of string columns, with one value per trial. If a variable was #
+	logged more than once in a trial, the last value is used. Variables #
+	that were not logged in a trial are empty.
+	"""
+
+	inside = np.in1d(variables[u'trial'], trials)
+	names = variables[u'name'][inside]
+	values = variables[u'value'][inside]
+	row = np.searchsorted(trials, variables[u'trial'][inside])
+	table = {}
+	for name in np.unique(names):
+		column = np.zeros(len(trials), dtype=values.dtype)
+		# Later assignments win, so the last value is kept
+		mask = names == name
+		column[row[mask]] = values[mask]
+		table[name] = column
+	return table
+
+def same_values(a, b):
+
+	"""
+	Compares two string columns, numerically if both are numeric
+
+	Arguments:
+	a -- a string array
+	b -- a string array
+
+	Returns:
+	A bool array
+	"""
+
+	try:
+		x = a.astype(np.float64)
+		y = b.astype(np.float64)
+	except ValueError:
+		return np.char.strip(a) == np.char.strip(b)
+	return np.isclose(x, y) | (np.isnan(x) & np.isnan(y))
+
+def merge(header, log, tables, key=None):
+
+	"""
+	Merges a logfile with eye-tracking data
+
+	Arguments:
+	header -- the column names of the logfile
+	log -- the logfile table, see read_log()
+	tables -- the eye-tracking tables, see libasc.parse_asc()
+
+	Keyword arguments:
+	key -- a variable that identifies trials, or None to match in order #
+		   (default=None)
+
+	Returns:
+	A (header, table) tuple with one row per logfile row
+	"""
+
+	n = len(log[header[0]]) if len(header) > 0 else 0
+	trials = tables[u'trials'][u'trial']
+	variables = variable_table(tables[u'variables'], trials)
+	# The trial index of each logfile row, or -1 if there is no trial
+	if key != None:
+		if key not in log or key not in variables:
+			raise ValueError(u'%s is not in both the logfile and the eye data' \
+				% key)
+		order = np.argsort(variables[key], kind=u'mergesort')
+		keys = variables[key][order]
+		index = np.full(n, -1, dtype=np.int64)
+		if len(keys) > 0:
+			pos = np.clip(np.searchsorted(keys, log[key]), 0, len(keys) - 1)
+			hit = keys[pos] == log[key]
+			index[hit] = order[pos[hit]]
+	else:
+		index = np.arange(n)
+		index[index >= len(trials)] = -1
+	matched = index >= 0
+	mismatch = np.zeros(n, dtype=np.int32)
+	mismatch[~matched] = 1
+	mismatch_vars = np.zeros(n, dtype=u'U256')
+	mismatch_vars[~matched] = u'[no trial]'
+	for name in sorted(set(header) & set(variables)):
+		if name == key:
+			continue
+		logged = variables[name][index[matched]]
+		compared = logged != u''
+		differs = np.zeros(n, dtype=bool)
+		differs[np.flatnonzero(matched)[compared]] = ~same_values( \
+			log[name][matched][compared], logged[compared])
+		mismatch += differs
+		mismatch_vars[differs] = np.char.add(mismatch_vars[differs], \
+			np.where(mismatch_vars[differs] == u'', name, u';' + name))
+	merged = dict(log)
+	merged_header = list(header)
+	features = libasc.trial_features(tables)
+	for name in [u'trial', u'start', u'end', u'duration', u'n_samples', \
+		u'track_loss', u'n_fixations', u'mean_fixation_duration', \
+		u'n_saccades', u'mean_saccade_amplitude', u'n_blinks']:
+		column = np.full(n, np.nan)
+		column[matched] = features[name][index[matched]]
+		merged[u'eye_' + name] = column
+		merged_header.append(u'eye_' + name)
+	merged[u'eye_mismatch'] = mismatch
+	merged[u'eye_mismatch_vars'] = mismatch_vars
+	merged_header += [u'eye_mismatch', u'eye_mismatch_vars']
+	return merged_header, merged
+
+def write_log(path, header, table):
+
+	"""
+	Writes a table as a CSV file. Missing numbers are written as NA, like #
+	OpenSesame does. Float columns that only contain whole numbers, such as #
+	timestamps, are written as integers, and other floats with 10 #
+	significant digits.
+
+	Arguments:
+	path -- the path of the CSV file
+	header -- the column names
+	table -- a dict of columns
+	"""
+
+	with open(path, u'wb') as fd:
+		writer = csv.writer(fd)
+		writer.writerow([name.encode(u'utf-8') for name in header])
+		n = len(table[header[0]]) if len(header) > 0 else 0
+		columns = []
+		for name in header:
+			column = table[name]
+			if column.dtype.kind == u'f':
+				missing = np.isnan(column)
+				if np.all(column[~missing] == np.round(column[~missing])):
+					text = np.char.mod(u'%d', np.where(missing, 0, \
+						column).astype(np.int64))
+				else:
+					text = np.char.mod(u'%.10g', column)
+				# An object array, because a string array is only as wide as its
+				# longest number, and would truncate NA
+				text = text.astype(object)
+				text[missing] = u'NA'
+				column = text
+			columns.append([(u'%s' % value).encode(u'utf-8') for value \
+				in column])
+		writer.writerows(zip(*columns) if n > 0 else [])
+
+def main():
+
+	"""Merges a logfile with eye-tracking data"""
+
+	parser = argparse.ArgumentParser(description= \
+		u'Merges an OpenSesame logfile with EyeLink data')
+	parser.add_argument(u'logfile', help=u'the OpenSesame logfile')
+	parser.add_argument(u'--eye-data', default=None, help= \
+		u'the ASC or npz file (default=the ASC file that belongs to the ' \
+		u'logfile)')
+	parser.add_argument(u'--key', default=None, help= \
+		u'a variable that identifies trials (default=match in order)')
+	parser.add_argument(u'--output', default=None, help= \
+		u'the merged CSV file (default=[logfile]_eye.csv)')
+	args = parser.parse_args()
+
+	eye_data = args.eye_data
+	if eye_data == None:
+		eye_data = os.path.join(os.path.dirname(args.logfile), \
+			os.path.splitext(data_file_name(args.logfile))[0] + u'.asc')
+	if eye_data.lower().endswith(u'.npz'):
+		tables = libasc.load_npz(eye_data)
+	else:
+		tables = libasc.parse_asc(eye_data)
+	header, log = read_log(args.logfile)
+	header, merged = merge(header, log, tables, key=args.key)
+	output = args.output if args.output != None else \
+		os.path.splitext(args.logfile)[0] + u'_eye.csv'
+	write_log(output, header, merged)
+	n = len(merged[u'eye_mismatch'])
+	flagged = np.count_nonzero(merged[u'eye_mismatch'])
+	print u'eyelink_merge: %d rows, %d trials, %d flagged, written to %s' % \
+		(n, len(tables[u'trials'][u'trial']), flagged, output)
+	return 1 if flagged > 0 else 0
+
+if __name__ == u'__main__':
+	sys.exit(main())
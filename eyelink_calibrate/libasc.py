@@ -0,0 +1,712 @@
+"""
+This file is part of OpenSesame.
+
+OpenSesame is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+OpenSesame is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with OpenSesame.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Parses ASC files (EDF files converted with edf2asc) into columnar NumPy
+arrays. The file is read in chunks of lines, so that memory use depends on the
+size of the result, and not on the size of the text file. Within a chunk, the
+numeric columns are converted in one go.
+
+The parser understands the messages that the eyelink plug-ins write: trials
+start with a 'start_trial' (eyelink_start_recording) or TRIALID message
+(continuous recording), and end with a 'stop_trial' (eyelink_stop_recording)
+or TRIAL_RESULT message. 'var [name] [value]' messages, written by log_var()
+and eyelink_log, are collected per trial, as is the drift-correction result
+that the tracker writes after eyelink_drift_correct.
+
+The result is a dict of tables, each of which is a dict of equally long
+columns:
+
+samples				time, trial, x_left, y_left, pupil_left, x_right, y_right,
+					pupil_right
+fixations			trial, eye, start, end, duration, x, y, pupil
+saccades			trial, eye, start, end, duration, start_x, start_y, end_x,
+					end_y, amplitude, peak_velocity
+blinks				trial, eye, start, end, duration
+messages			trial, time, text
+trials				trial, start, end, label
+variables			trial, time, name, value
+drift_corrections	trial, time, eye, target_x, target_y, offset_deg,
+					offset_x, offset_y
+
+Missing values are NaN, eyes are 0 (left) or 1 (right), and trial is -1
+outside of trials.
+
+For random access to single trials, asc_index scans the file once for the same
+trial messages, and stores the byte offsets of the trials in a sidecar file.
+
+Usage:
+python libasc.py [file.asc] [file.npz]
+python libasc.py --index [file.asc]
+"""
+
+import os
+import re
+import sys
+import json
+import itertools
+import numpy as np
+
+EYES = {u'L' : 0, u'R' : 1, u'LEFT' : 0, u'RIGHT' : 1}
+
+# The messages that start and end a trial, see asc_parser
+TRIAL_START = (u'start_trial', u'TRIALID')
+TRIAL_END = (u'stop_trial', u'TRIAL_RESULT')
+
+# The columns of each table, as (name, dtype) tuples
+COLUMNS = {
+	u'samples' : [(u'time', np.int64), (u'trial', np.int32), \
+		(u'x_left', np.float32), (u'y_left', np.float32), \
+		(u'pupil_left', np.float32), (u'x_right', np.float32), \
+		(u'y_right', np.float32), (u'pupil_right', np.float32)],
+	u'fixations' : [(u'trial', np.int32), (u'eye', np.int8), \
+		(u'start', np.int64), (u'end', np.int64), (u'duration', np.int32), \
+		(u'x', np.float32), (u'y', np.float32), (u'pupil', np.float32)],
+	u'saccades' : [(u'trial', np.int32), (u'eye', np.int8), \
+		(u'start', np.int64), (u'end', np.int64), (u'duration', np.int32), \
+		(u'start_x', np.float32), (u'start_y', np.float32), \
+		(u'end_x', np.float32), (u'end_y', np.float32), \
+		(u'amplitude', np.float32), (u'peak_velocity', np.float32)],
+	u'blinks' : [(u'trial', np.int32), (u'eye', np.int8), \
+		(u'start', np.int64), (u'end', np.int64), (u'duration', np.int32)],
+	u'messages' : [(u'trial', np.int32), (u'time', np.int64), \
+		(u'text', np.unicode_)],
+	u'trials' : [(u'trial', np.int32), (u'start', np.int64), \
+		(u'end', np.int64), (u'label', np.unicode_)],
+	u'variables' : [(u'trial', np.int32), (u'time', np.int64), \
+		(u'name', np.unicode_), (u'value', np.unicode_)],
+	u'drift_corrections' : [(u'trial', np.int32), (u'time', np.int64), \
+		(u'eye', np.int8), (u'target_x', np.float32), \
+		(u'target_y', np.float32), (u'offset_deg', np.float32), \
+		(u'offset_x', np.float32), (u'offset_y', np.float32)]
+	}
+
+# The numeric fields of event lines, after the eye
+EVENT_FIELDS = {
+	u'EFIX' : (u'fixations', 6),
+	u'ESACC' : (u'saccades', 9),
+	u'EBLINK' : (u'blinks', 3)
+	}
+
+# For example: DRIFTCORRECT R RIGHT at 512,384  OFFSET 0.35 deg.  12.3,-4.5 pix.
+DRIFT_CORRECT = re.compile(r'DRIFTCORRECT\s+(?:[LR]\s+)?(LEFT|RIGHT)\s+at\s+' \
+	r'(-?\d+),(-?\d+)\s+OFFSET\s+(-?[\d.]+)\s+deg\.\s+(-?[\d.]+),(-?[\d.]+)' \
+	r'\s+pix\.')
+
+def to_float(tokens):
+
+	"""
+	Converts string tokens to floats, in one go
+
+	Arguments:
+	tokens -- a list of strings, in which '.' indicates a missing value
+
+	Returns:
+	A float array
+	"""
+
+	a = np.array(tokens)
+	if a.dtype.kind in u'SU':
+		a[a == a.dtype.type('.')] = 'nan'
+	return a.astype(np.float64)
+
+def read_eyes(words, eyes):
+
+	"""
+	Gets the recorded eyes from a START or SAMPLES line
+
+	Arguments:
+	words -- the words of the line
+	eyes -- the eyes that are returned if the line does not specify them
+
+	Returns:
+	A list of eyes
+	"""
+
+	return [eye for name, eye in [(u'LEFT', 0), (u'RIGHT', 1)] \
+		if name in words] or eyes
+
+class asc_parser:
+
+	"""
+	Parses an ASC file chunk by chunk. The parser keeps track of the recorded
+	eyes and the current trial between chunks.
+	"""
+
+	def __init__(self, trial_start=TRIAL_START, trial_end=TRIAL_END):
+
+		"""
+		Constructor
+
+		Keyword arguments:
+		trial_start -- message prefixes that start a trial. A start message #
+					   during a trial is ignored, so that the TRIALID and #
+					   start_trial messages of a single trial do not count #
+					   twice. (default=(u'start_trial', u'TRIALID'))
+		trial_end -- message prefixes that end a trial. An end message #
+					 outside of a trial is ignored. #
+					 (default=(u'stop_trial', u'TRIAL_RESULT'))
+		"""
+
+		self.trial_start = tuple(trial_start)
+		self.trial_end = tuple(trial_end)
+		# The eyes that are in the sample columns
+		self.eyes = [0]
+		self.trial_nr = 0
+		self.trial = -1
+		self.trial_onset = None
+		self.trial_label = None
+		self.last_time = 0
+
+	def feed(self, lines):
+
+		"""
+		Parses a chunk of lines
+
+		Arguments:
+		lines -- a list of lines
+
+		Returns:
+		A dict of tables
+		"""
+
+		rows = dict([(table, []) for table in COLUMNS])
+		# Samples are parsed in runs that have the same eyes
+		sample_runs = []
+		tokens = []
+		eyes = None
+		# The trial changes in this chunk, as (time, trial) tuples
+		transitions = [(-1, self.trial)]
+		for line in lines:
+			if line[:1].isdigit():
+				fields = line.split()
+				if eyes != self.eyes:
+					if len(tokens) > 0:
+						sample_runs.append((eyes, tokens))
+					eyes = self.eyes
+					tokens = []
+					ncols = 1 + 3 * len(eyes)
+				if len(fields) >= ncols:
+					tokens += fields[:ncols]
+				continue
+			fields = line.split(None, 2)
+			if len(fields) == 0:
+				continue
+			kind = fields[0]
+			if kind == u'MSG' and len(fields) >= 2:
+				t = int(fields[1])
+				text = fields[2].strip() if len(fields) > 2 else u''
+				self.message(t, text, rows, transitions)
+			elif kind in EVENT_FIELDS:
+				fields = line.split()
+				table, n = EVENT_FIELDS[kind]
+				if len(fields) >= 2 + n:
+					rows[table].append([self.trial, EYES[fields[1]]] + \
+						fields[2:2 + n])
+			elif kind in (u'START', u'SAMPLES'):
+				self.eyes = read_eyes(line.split(), self.eyes)
+		if len(tokens) > 0:
+			sample_runs.append((eyes, tokens))
+		return self.tables(rows, sample_runs, transitions)
+
+	def message(self, t, text, rows, transitions):
+
+		"""
+		Handles a message
+
+		Arguments:
+		t -- the timestamp
+		text -- the message text
+		rows -- the rows of the current chunk
+		transitions -- the trial changes of the current chunk
+		"""
+
+		self.last_time = t
+		if text.startswith(self.trial_start) and self.trial == -1:
+			self.trial_nr += 1
+			self.trial = self.trial_nr
+			self.trial_onset = t
+			self.trial_label = text
+			transitions.append((t, self.trial))
+		rows[u'messages'].append([self.trial, t, text])
+		if text.startswith(u'var '):
+			var = text.split(None, 2)
+			if len(var) >= 2:
+				rows[u'variables'].append([self.trial, t, var[1], \
+					var[2] if len(var) > 2 else u''])
+		m = DRIFT_CORRECT.search(text)
+		if m != None:
+			rows[u'drift_corrections'].append([self.trial, t, \
+				EYES[m.group(1)]] + list(m.groups()[1:]))
+		if text.startswith(self.trial_end) and self.trial != -1:
+			rows[u'trials'].append([self.trial, self.trial_onset, t, \
+				self.trial_label])
+			self.trial = -1
+			transitions.append((t + 1, -1))
+
+	def finish(self):
+
+		"""
+		Ends parsing. A trial that has not ended is ended at the last #
+		message.
+
+		Returns:
+		A dict of tables
+		"""
+
+		rows = dict([(table, []) for table in COLUMNS])
+		if self.trial != -1:
+			rows[u'trials'].append([self.trial, self.trial_onset, \
+				self.last_time, self.trial_label])
+			self.trial = -1
+		return self.tables(rows, [], [(-1, -1)])
+
+	def tables(self, rows, sample_runs, transitions):
+
+		"""
+		Converts parsed rows to tables
+
+		Arguments:
+		rows -- a dict of lists of rows
+		sample_runs -- a list of (eyes, tokens) tuples
+		transitions -- the trial changes, as (time, trial) tuples
+
+		Returns:
+		A dict of tables
+		"""
+
+		result = {}
+		for table, rows in rows.items():
+			if table == u'samples':
+				continue
+			if len(rows) == 0:
+				result[table] = empty_table(table)
+				continue
+			result[table] = {}
+			for (name, dtype), column in zip(COLUMNS[table], zip(*rows)):
+				if dtype == np.unicode_:
+					result[table][name] = np.array(column, dtype=dtype)
+				else:
+					result[table][name] = to_float(list(column)).astype(dtype)
+		samples = empty_table(u'samples')
+		for eyes, tokens in sample_runs:
+			a = to_float(tokens).reshape(-1, 1 + 3 * len(eyes))
+			run = empty_table(u'samples', len(a))
+			run[u'time'][:] = a[:, 0]
+			for i, eye in enumerate(eyes):
+				suffix = [u'_left', u'_right'][eye]
+				run[u'x' + suffix][:] = a[:, 1 + 3 * i]
+				run[u'y' + suffix][:] = a[:, 2 + 3 * i]
+				run[u'pupil' + suffix][:] = a[:, 3 + 3 * i]
+			samples = concatenate([samples, run])
+		# Look up the trial of each sample in the trial changes
+		times = np.array([t for t, trial in transitions])
+		trials = np.array([trial for t, trial in transitions])
+		samples[u'trial'][:] = trials[np.searchsorted(times, \
+			samples[u'time'], side=u'right') - 1]
+		result[u'samples'] = samples
+		return result
+
+def empty_table(table, n=0):
+
+	"""
+	Creates a table with NaN or -1 values
+
+	Arguments:
+	table -- the name of the table
+
+	Keyword arguments:
+	n -- the number of rows (default=0)
+
+	Returns:
+	A dict of columns
+	"""
+
+	columns = {}
+	for name, dtype in COLUMNS[table]:
+		if dtype == np.unicode_:
+			columns[name] = np.zeros(n, dtype=u'U1')
+		elif np.issubdtype(dtype, np.floating):
+			columns[name] = np.full(n, np.nan, dtype=dtype)
+		else:
+			columns[name] = np.full(n, -1, dtype=dtype)
+	return columns
+
+def concatenate(tables):
+
+	"""
+	Concatenates tables with the same columns
+
+	Arguments:
+	tables -- a list of tables
+
+	Returns:
+	A table
+	"""
+
+	return dict([(name, np.concatenate([table[name] for table in tables])) \
+		for name in tables[0]])
+
+def concatenate_chunks(chunks):
+
+	"""
+	Concatenates the tables of several chunks
+
+	Arguments:
+	chunks -- a list of dicts of tables
+
+	Returns:
+	A dict of tables
+	"""
+
+	return dict([(table, concatenate([chunk[table] for chunk in chunks])) \
+		for table in COLUMNS])
+
+def iter_asc(path, chunk_lines=100000, **kwargs):
+
+	"""
+	Parses an ASC file chunk by chunk
+
+	Arguments:
+	path -- the path of the ASC file
+
+	Keyword arguments:
+	chunk_lines -- the number of lines per chunk (default=100000)
+	kwargs -- keyword arguments for asc_parser
+
+	Returns:
+	A generator of dicts of tables, one per chunk
+	"""
+
+	parser = asc_parser(**kwargs)
+	with open(path) as fd:
+		while True:
+			lines = list(itertools.islice(fd, chunk_lines))
+			if len(lines) == 0:
+				break
+			yield parser.feed(lines)
+	yield parser.finish()
+
+def parse_asc(path, chunk_lines=100000, **kwargs):
+
+	"""
+	Parses an ASC file
+
+	Arguments:
+	path -- the path of the ASC file
+
+	Keyword arguments:
+	chunk_lines -- the number of lines per chunk (default=100000)
+	kwargs -- keyword arguments for asc_parser
+
+	Returns:
+	A dict of tables
+	"""
+
+	return concatenate_chunks(list(iter_asc(path, chunk_lines, **kwargs)))
+
+def trial_features(tables):
+
+	"""
+	Summarizes the eye movements of each trial
+
+	Arguments:
+	tables -- a dict of tables, see parse_asc()
+
+	Returns:
+	A table with the columns trial, start, end, duration, n_samples, #
+	track_loss (the proportion of samples without gaze position), #
+	n_fixations, mean_fixation_duration, n_saccades, #
+	mean_saccade_amplitude, and n_blinks. Means are NaN for trials without #
+	events.
+	"""
+
+	trials = tables[u'trials']
+	nr = trials[u'trial']
+	size = nr.max() + 1 if len(nr) > 0 else 1
+
+	def count(table, weights=None):
+		# Sums per trial, ignoring rows outside of trials
+		trial = table[u'trial']
+		inside = trial >= 0
+		if weights is not None:
+			weights = np.where(np.isnan(weights), 0, weights)[inside]
+		return np.bincount(trial[inside], weights, minlength=size)[nr] \
+			.astype(np.float64)
+
+	def mean(table, column):
+		with np.errstate(invalid=u'ignore', divide=u'ignore'):
+			return count(table, table[column].astype(np.float64)) / \
+				count(table)
+
+	samples = tables[u'samples']
+	lost = np.isnan(samples[u'x_left']) & np.isnan(samples[u'x_right'])
+	n_samples = count(samples)
+	with np.errstate(invalid=u'ignore', divide=u'ignore'):
+		track_loss = count(samples, lost.astype(np.float64)) / n_samples
+	return {
+		u'trial' : nr,
+		u'start' : trials[u'start'],
+		u'end' : trials[u'end'],
+		u'duration' : trials[u'end'] - trials[u'start'],
+		u'n_samples' : n_samples.astype(np.int64),
+		u'track_loss' : track_loss,
+		u'n_fixations' : count(tables[u'fixations']).astype(np.int64),
+		u'mean_fixation_duration' : mean(tables[u'fixations'], \
+			u'duration'),
+		u'n_saccades' : count(tables[u'saccades']).astype(np.int64),
+		u'mean_saccade_amplitude' : mean(tables[u'saccades'], u'amplitude'),
+		u'n_blinks' : count(tables[u'blinks']).astype(np.int64)
+		}
+
+def save_npz(tables, path):
+
+	"""
+	Saves tables to an npz file, in which each column is stored as #
+	[table].[column]
+
+	Arguments:
+	tables -- a dict of tables
+	path -- the path of the npz file
+	"""
+
+	arrays = {}
+	for table, columns in tables.items():
+		for name, column in columns.items():
+			arrays[u'%s.%s' % (table, name)] = column
+	np.savez(path, **arrays)
+
+def load_npz(path):
+
+	"""
+	Loads tables that have been saved with save_npz()
+
+	Arguments:
+	path -- the path of the npz file
+
+	Returns:
+	A dict of tables
+	"""
+
+	tables = {}
+	with np.load(path) as npz:
+		for key in npz.files:
+			table, name = key.split(u'.', 1)
+			tables.setdefault(table, {})[name] = npz[key]
+	return tables
+
+class asc_index:
+
+	"""
+	An index of the trials in an ASC file, which allows single trials to be #
+	read without scanning the file. The index holds the byte offsets of the #
+	first and last line of each trial, together with its timestamps, label #
+	and var messages, and is stored next to the ASC file as #
+	[file].idx.json. When the ASC file has grown, update() only scans the #
+	new part.
+	"""
+
+	VERSION = 1
+	# The first bytes of the file are used to detect that the file has been
+	# replaced
+	SIGNATURE_SIZE = 4096
+
+	def __init__(self, path, index_path=None, trial_start=TRIAL_START, \
+		trial_end=TRIAL_END):
+
+		"""
+		Constructor. Loads the index if it exists, and updates it.
+
+		Arguments:
+		path -- the path of the ASC file
+
+		Keyword arguments:
+		index_path -- the path of the index, or None for [path].idx.json #
+					  (default=None)
+		trial_start -- see asc_parser (default=TRIAL_START)
+		trial_end -- see asc_parser (default=TRIAL_END)
+		"""
+
+		self.path = path
+		self.index_path = index_path if index_path != None else path + \
+			u'.idx.json'
+		self.trial_start = tuple(trial_start)
+		self.trial_end = tuple(trial_end)
+		self.index = None
+		if os.path.exists(self.index_path):
+			with open(self.index_path) as fd:
+				self.index = json.load(fd)
+			if self.index.get(u'version') != self.VERSION or \
+				self.index[u'signature'] != self.signature():
+				self.index = None
+		if self.index == None:
+			self.index = {u'version' : self.VERSION, u'signature' : \
+				self.signature(), u'scanned' : 0, u'eyes' : [0], \
+				u'open' : None, u'trials' : []}
+		self.update()
+
+	def signature(self):
+
+		"""
+		Returns:
+		The first bytes of the ASC file, as a string
+		"""
+
+		with open(self.path, u'rb') as fd:
+			return fd.read(self.SIGNATURE_SIZE).decode(u'ascii', u'ignore')
+
+	def update(self):
+
+		"""
+		Scans the part of the file that has not been scanned yet, and saves #
+		the index. A trial that is still running is kept open, and is #
+		completed by a later update().
+
+		Returns:
+		The number of trials in the index
+		"""
+
+		index = self.index
+		if os.path.getsize(self.path) < index[u'scanned'] or \
+			len(index[u'signature']) < self.SIGNATURE_SIZE:
+			# The file has been truncated, or was still very short, so check
+			# whether it is still the same file
+			if self.signature()[:len(index[u'signature'])] != \
+				index[u'signature'] or os.path.getsize(self.path) < \
+				index[u'scanned']:
+				index.update({u'scanned' : 0, u'eyes' : [0], u'open' : \
+					None, u'trials' : []})
+			index[u'signature'] = self.signature()
+		offset = index[u'scanned']
+		with open(self.path, u'rb') as fd:
+			fd.seek(offset)
+			for line in fd:
+				# Don't index a line that is still being written
+				if not line.endswith(b'\n'):
+					break
+				self.scan_line(line.decode(u'ascii', u'ignore'), offset)
+				offset += len(line)
+		index[u'scanned'] = offset
+		with open(self.index_path + u'.tmp', u'w') as fd:
+			json.dump(index, fd)
+		if os.path.exists(self.index_path):
+			os.remove(self.index_path)
+		os.rename(self.index_path + u'.tmp', self.index_path)
+		return len(index[u'trials'])
+
+	def scan_line(self, line, offset):
+
+		"""
+		Indexes a line
+
+		Arguments:
+		line -- the line
+		offset -- the byte offset of the line
+		"""
+
+		index = self.index
+		if line.startswith((u'START', u'SAMPLES')):
+			index[u'eyes'] = read_eyes(line.split(), index[u'eyes'])
+			return
+		if not line.startswith(u'MSG'):
+			return
+		fields = line.split(None, 2)
+		if len(fields) < 3:
+			return
+		t = int(fields[1])
+		text = fields[2].strip()
+		trial = index[u'open']
+		if trial == None:
+			if text.startswith(self.trial_start):
+				index[u'open'] = {u'trial' : len(index[u'trials']) + 1, \
+					u'label' : text, u'start' : t, u'end' : None, \
+					u'offset' : offset, u'end_offset' : None, u'eyes' : \
+					index[u'eyes'], u'vars' : {}}
+			return
+		if text.startswith(u'var '):
+			var = text.split(None, 2)
+			if len(var) >= 2:
+				trial[u'vars'][var[1]] = var[2] if len(var) > 2 else u''
+		elif text.startswith(self.trial_end):
+			trial[u'end'] = t
+			trial[u'end_offset'] = offset + len(line)
+			index[u'trials'].append(trial)
+			index[u'open'] = None
+
+	def trials(self):
+
+		"""
+		Returns:
+		A list of dicts with the trial number, label, start and end time, #
+		the recorded eyes, the var messages, and the byte offsets of each #
+		trial
+		"""
+
+		return self.index[u'trials']
+
+	def read_trial(self, trial):
+
+		"""
+		Reads the lines of a single trial
+
+		Arguments:
+		trial -- the trial number, starting at 1
+
+		Returns:
+		A list of lines
+		"""
+
+		entry = self.index[u'trials'][trial - 1]
+		with open(self.path, u'rb') as fd:
+			fd.seek(entry[u'offset'])
+			data = fd.read(entry[u'end_offset'] - entry[u'offset'])
+		return data.decode(u'ascii', u'ignore').splitlines(True)
+
+	def load_trial(self, trial):
+
+		"""
+		Parses a single trial
+
+		Arguments:
+		trial -- the trial number, starting at 1
+
+		Returns:
+		A dict of tables, see parse_asc()
+		"""
+
+		entry = self.index[u'trials'][trial - 1]
+		parser = asc_parser(self.trial_start, self.trial_end)
+		parser.eyes = entry[u'eyes']
+		parser.trial_nr = trial - 1
+		return concatenate_chunks([parser.feed(self.read_trial(trial)), \
+			parser.finish()])
+
+if __name__ == u'__main__':
+	if len(sys.argv) < 2:
+		print u'Usage: python libasc.py [file.asc] [file.npz]'
+		print u'       python libasc.py --index [file.asc]'
+		sys.exit(1)
+	if sys.argv[1] == u'--index':
+		index = asc_index(sys.argv[2])
+		print u'%s: %d trials' % (index.index_path, len(index.trials()))
+		sys.exit(0)
+	src = sys.argv[1]
+	dest = sys.argv[2] if len(sys.argv) > 2 else src[:-4] + u'.npz'
+	tables = parse_asc(src)
+	save_npz(tables, dest)
+	for table in sorted(tables):
+		print u'%s: %d rows' % (table, len(tables[table].values()[0]))
@@ -0,0 +1,77 @@
+"""
+This file is part of OpenSesame.
+
+OpenSesame is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+OpenSesame is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with OpenSesame.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Estimates the size of EDF files. This module has no dependencies, so that the
+eyelink_calibrate edit widget can use it without loading libeyelink.
+"""
+
+# The approximate size in bytes of each field in an EDF sample, and whether the
+# field is stored separately for each eye. Also the approximate number of bytes
+# per second that each event type adds to an EDF file, assuming about three
+# fixations and saccades per second. These are used to estimate file sizes.
+EDF_SAMPLE_OVERHEAD = 8
+EDF_SAMPLE_BYTES = {
+	u'GAZE' : (8, True),
+	u'HREF' : (8, True),
+	u'PUPIL' : (8, True),
+	u'AREA' : (4, True),
+	u'GAZERES' : (8, False),
+	u'STATUS' : (2, False),
+	u'INPUT' : (2, False),
+	u'BUTTON' : (4, False),
+	u'HTARGET' : (8, False),
+	}
+EDF_EVENT_BYTES_PER_S = {
+	u'FIXATION' : 390,
+	u'SACCADE' : 390,
+	u'BLINK' : 15,
+	u'MESSAGE' : 10,
+	u'BUTTON' : 1,
+	u'INPUT' : 1,
+	}
+
+def edf_bytes_per_hour(sample_data, event_filter, sample_rate=1000, eyes=1):
+
+	"""
+	Estimates the size of an EDF file per hour of recording.
+
+	Arguments:
+	sample_data		--	A comma-separated list of sample fields, as in the #
+						file_sample_data setting.
+	event_filter	--	A comma-separated list of event types, as in the #
+						file_event_filter setting.
+
+	Keyword arguments:
+	sample_rate		--	The sample rate in Hz. (default=1000)
+	eyes			--	The number of eyes that are recorded. (default=1)
+
+	Returns:
+	The estimated number of bytes per hour.
+	"""
+
+	sample_bytes = EDF_SAMPLE_OVERHEAD
+	for field in sample_data.split(u','):
+		if field in EDF_SAMPLE_BYTES:
+			size, per_eye = EDF_SAMPLE_BYTES[field]
+			if per_eye:
+				size *= eyes
+			sample_bytes += size
+	event_bytes = 0
+	for field in event_filter.split(u','):
+		event_bytes += eyes * EDF_EVENT_BYTES_PER_S.get(field, 0)
+	return 3600 * (sample_rate * sample_bytes + event_bytes)
@@ -31,22 +31,556 @@ from openexp.synth import synth
 from openexp.exceptions import response_error
 from libopensesame import exceptions
 import os.path
+from libtransfer import connect, load_manifest, save_manifest, \
+	is_pending, add_pending_file, edf_transfer
+from libmirror import link_mirror, mirror_dtype, read_mirror, mirror_gaps
+from libedf import edf_bytes_per_hour
 import array
 import math
+import re
+import json
+import time
+import random
 import tempfile
-try:
-	import Image
-except:
-	from PIL import Image
+import threading
+# PIL is only needed to show the camera image, and is imported by the
+# camera_renderer when it first converts a frame.
+Image = None
 
 _eyelink = None
+_graphics = None
+
+# The settings that can occur in a tracker configuration, and the fields that
+# are allowed in the settings that take a list of fields.
+CONFIG_SETTINGS = [u'screen_pixel_coords', u'select_parser_configuration', \
+	u'scene_camera_gazemap', u'saccade_velocity_threshold', \
+	u'saccade_acceleration_threshold', u'file_event_filter', \
+	u'file_event_data', u'file_sample_data', u'link_event_filter', \
+	u'link_event_data', u'link_sample_data', u'button_function']
+FIELD_SETTINGS = {
+	u'file_event_filter' : [u'LEFT', u'RIGHT', u'FIXATION', u'SACCADE', \
+		u'BLINK', u'MESSAGE', u'BUTTON', u'INPUT', u'FIXUPDATE'],
+	u'link_event_filter' : [u'LEFT', u'RIGHT', u'FIXATION', u'SACCADE', \
+		u'BLINK', u'MESSAGE', u'BUTTON', u'INPUT', u'FIXUPDATE'],
+	u'file_event_data' : [u'GAZE', u'GAZERES', u'HREF', u'AREA', \
+		u'VELOCITY', u'STATUS', u'FIXAVG', u'NOSTART'],
+	u'link_event_data' : [u'GAZE', u'GAZERES', u'HREF', u'AREA', \
+		u'VELOCITY', u'STATUS', u'FIXAVG', u'NOSTART'],
+	u'file_sample_data' : [u'LEFT', u'RIGHT', u'GAZE', u'GAZERES', u'HREF', \
+		u'PUPIL', u'AREA', u'STATUS', u'INPUT', u'BUTTON', u'HTARGET'],
+	u'link_sample_data' : [u'LEFT', u'RIGHT', u'GAZE', u'GAZERES', u'HREF', \
+		u'PUPIL', u'AREA', u'STATUS', u'INPUT', u'BUTTON', u'HTARGET'],
+	}
+
+# The link data profiles. Each profile specifies which events are sent over the
+# link, and which fields are included in link samples and events. HTARGET is
+# added to the samples of the full profile on trackers that support it.
+LINK_PROFILES = {
+	u'gaze' : {
+		u'link_event_filter' : u'LEFT,RIGHT,FIXATION,SACCADE,BLINK,BUTTON',
+		u'link_event_data' : u'GAZE,STATUS',
+		u'link_sample_data' : u'LEFT,RIGHT,GAZE,STATUS'
+		},
+	u'gaze+pupil' : {
+		u'link_event_filter' : u'LEFT,RIGHT,FIXATION,SACCADE,BLINK,BUTTON',
+		u'link_event_data' : u'GAZE,AREA,STATUS',
+		u'link_sample_data' : u'LEFT,RIGHT,GAZE,AREA,STATUS'
+		},
+	u'full' : {
+		u'link_event_filter' : u'LEFT,RIGHT,FIXATION,SACCADE,BLINK,BUTTON',
+		u'link_event_data' : u'GAZE,GAZERES,HREF,AREA,VELOCITY,STATUS',
+		u'link_sample_data' : u'LEFT,RIGHT,GAZE,GAZERES,AREA,STATUS'
+		},
+	}
+
+# The settings that are known to be in effect on the tracker, as a dict that
+# maps setting names onto values. Commands that change one of the
+# CACHED_SETTINGS to the value that is already in effect are not sent again.
+# The state is cleared when the connection is (re)established, and after
+# set-up, during which the experimenter may change settings on the tracker.
+_tracker_state = {}
+CACHED_SETTINGS = [setting for setting in CONFIG_SETTINGS \
+	if setting != u'button_function'] + [u'heuristic_filter', \
+	u'drift_correction_targets', u'driftcorrect_cr_disable', \
+	u'enable_automatic_calibration', u'automatic_calibration_pacing', \
+	u'record_status_message']
+
+class recording_status:
+
+	"""
+	Describes the outcome of an attempt to start recording. Every failed #
+	startRecording() call is stored as a (time, error, classification) tuple, #
+	where time is the time in milliseconds since the first attempt.
+	"""
+
+	# Error codes that startRecording() may return, mapped onto a description
+	# and a boolean that indicates whether retrying makes sense
+	ERROR_CLASSES = {
+		1000 : (u'no reply', True),
+		-100 : (u'link terminated', False),
+		27 : (u'aborted', False),
+		-1 : (u'unexpected end of line', False),
+		-2 : (u'syntax error', False),
+		-3 : (u'bad value', False),
+		-4 : (u'extra characters', False),
+		}
+
+	def __init__(self):
+
+		"""Constructor"""
+
+		self.success = False
+		self.attempts = 0
+		self.elapsed = 0
+		self.failures = []
+
+	def classify(self, error):
+
+		"""
+		Classifies an error code
+
+		Arguments:
+		error -- an error code returned by startRecording(), or an exception
+
+		Returns:
+		A (description, retry) tuple
+		"""
+
+		if isinstance(error, Exception):
+			return u'exception: %s' % error, False
+		return self.ERROR_CLASSES.get(error, (u'error %s' % error, True))
+
+	def add_failure(self, t, error):
+
+		"""
+		Stores a failed attempt
+
+		Arguments:
+		t -- the time since the first attempt in milliseconds
+		error -- an error code returned by startRecording(), or an exception
+
+		Returns:
+		True if retrying makes sense, False otherwise
+		"""
+
+		description, retry = self.classify(error)
+		self.failures.append((t, error, description))
+		return retry
+
+	def __str__(self):
+
+		"""
+		Returns:
+		A summary of the attempt
+		"""
+
+		if self.success:
+			s = u'recording started after %d attempt(s) in %d ms' % \
+				(self.attempts, self.elapsed)
+		else:
+			s = u'failed to start recording after %d attempt(s) in %d ms' % \
+				(self.attempts, self.elapsed)
+		if len(self.failures) > 0:
+			s += u' (%s)' % u', '.join([u'%s at %d ms' % (description, t) \
+				for t, error, description in self.failures])
+		return s
+
+def gaze_lost(x, y, resolution):
+
+	"""<DOC>
+	Checks whether a gaze position is missing. Besides (-1, -1), which #
+	sample_gaze() returns when there is no sample of the recorded eye, #
+	pylink reports pylink.MISSING_DATA or other out-of-range values during #
+	blinks and tracking loss. Gaze outside of the display is therefore #
+	counted as lost as well.
+
+	Arguments:
+	x			--	The x coordinate.
+	y			--	The y coordinate.
+	resolution	--	The (width, height) of the display.
+
+	Returns:
+	True if the gaze position is missing, False otherwise.
+	</DOC>"""
+
+	return not (0 <= x < resolution[0] and 0 <= y < resolution[1])
+
+class running_window:
+
+	"""
+	A fixed-capacity ring of (time, x, y) samples that keeps running sums, so #
+	that the mean and variance are available in constant time. Samples that #
+	are older than the time window, or that do not fit in the ring, are #
+	dropped. The sums are kept relative to an origin close to the samples, #
+	to avoid loss of precision.
+	"""
+
+	def __init__(self, capacity, window, origin=(0, 0)):
+
+		"""
+		Constructor
+
+		Arguments:
+		capacity -- the maximum number of samples
+		window -- the maximum age of a sample relative to the newest sample, #
+				  in milliseconds
+
+		Keyword arguments:
+		origin -- an (x, y) tuple near the expected samples (default=(0,0))
+		"""
+
+		self.capacity = capacity
+		self.window = window
+		self.ox, self.oy = origin
+		self.t = array.array('d', [0]) * capacity
+		self.x = array.array('d', [0]) * capacity
+		self.y = array.array('d', [0]) * capacity
+		self.clear()
+
+	def __len__(self):
+
+		"""
+		Returns:
+		The number of samples
+		"""
+
+		return self.n
+
+	def clear(self):
+
+		"""Removes all samples"""
+
+		self.head = 0
+		self.n = 0
+		self.sx = 0.
+		self.sy = 0.
+		self.sxx = 0.
+		self.syy = 0.
+
+	def push(self, t, x, y):
+
+		"""
+		Adds a sample, and drops samples that are too old
+
+		Arguments:
+		t -- the timestamp in milliseconds
+		x -- the x coordinate
+		y -- the y coordinate
+		"""
+
+		if self.n == self.capacity:
+			self.pop()
+		i = (self.head + self.n) % self.capacity
+		x -= self.ox
+		y -= self.oy
+		self.t[i] = t
+		self.x[i] = x
+		self.y[i] = y
+		self.sx += x
+		self.sy += y
+		self.sxx += x * x
+		self.syy += y * y
+		self.n += 1
+		while t - self.t[self.head] > self.window:
+			self.pop()
+
+	def pop(self):
+
+		"""Drops the oldest sample"""
+
+		i = self.head
+		x = self.x[i]
+		y = self.y[i]
+		self.sx -= x
+		self.sy -= y
+		self.sxx -= x * x
+		self.syy -= y * y
+		self.head = (i + 1) % self.capacity
+		self.n -= 1
+
+	def mean(self):
+
+		"""
+		Returns:
+		The mean (x, y) position
+		"""
+
+		return self.ox + self.sx / self.n, self.oy + self.sy / self.n
+
+	def variance(self):
+
+		"""
+		Returns:
+		The summed variance of x and y, in squared pixels
+		"""
+
+		mx = self.sx / self.n
+		my = self.sy / self.n
+		return max(0., self.sxx / self.n - mx * mx) + \
+			max(0., self.syy / self.n - my * my)
+
+class drift_estimator:
+
+	"""
+	Estimates the drift of the tracker during recording, by comparing #
+	fixations near known targets with the positions of these targets, and #
+	corrects gaze positions for it. For each axis, a gain and an offset are #
+	fitted with exponentially decaying weights, so that recent fixations #
+	count most. The gain is pulled towards 1, so that it is only adjusted #
+	when fixations on targets that are far apart are available.
+	"""
+
+	def __init__(self, center, capture_radius=60, decay=.9, gain_prior=4e4, \
+		min_duration=80, max_spread=15):
+
+		"""
+		Constructor
+
+		Arguments:
+		center -- the (x, y) center of the display, around which the gain #
+				  is applied
+
+		Keyword arguments:
+		capture_radius -- the maximum distance between a fixation and a #
+						  target (default=60)
+		decay -- the weight of the previous estimate for every new #
+				 fixation (default=.9)
+		gain_prior -- the weight with which the gain is pulled towards 1, #
+					  in squared pixels (default=4e4)
+		min_duration -- the minimum duration of a fixation in ms #
+						(default=80)
+		max_spread -- the maximum standard deviation of the samples in a #
+					  fixation in pixels (default=15)
+		"""
+
+		self.center = center
+		self.capture_radius = capture_radius
+		self.decay = decay
+		self.gain_prior = gain_prior
+		self.min_duration = min_duration
+		self.max_spread = max_spread
+		self.targets = []
+		# Room for a fixation at up to 2000 Hz
+		self.window = running_window(2 * min_duration + 1, min_duration)
+		self.reset()
+
+	def reset(self):
+
+		"""Forgets the estimate, but not the targets"""
+
+		# Per axis: the summed weights, raw positions, target positions,
+		# squared raw positions, and raw * target positions
+		self.sums = [[0.] * 5, [0.] * 5]
+		self.gain = [1., 1.]
+		self.offset = [0., 0.]
+		self.error = 0.
+		self.fixations = 0
+		self.window.clear()
+		self.fixation_start = None
+		self.fixation_used = False
+		self.last_time = None
+
+	def add_sample(self, t, x, y):
+
+		"""
+		Feeds a raw sample, and uses it to detect fixations
+
+		Arguments:
+		t -- the timestamp
+		x -- the raw x coordinate
+		y -- the raw y coordinate
+		"""
+
+		if t == self.last_time:
+			return
+		self.last_time = t
+		# The display is centered on the center that the gain is applied
+		# around
+		if gaze_lost(x, y, (2 * self.center[0], 2 * self.center[1])):
+			self.window.clear()
+			return
+		if len(self.window) > 0:
+			mx, my = self.window.mean()
+			if abs(x - mx) > 2 * self.max_spread or \
+				abs(y - my) > 2 * self.max_spread:
+				self.window.clear()
+		if len(self.window) == 0:
+			self.fixation_start = t
+			self.fixation_used = False
+		self.window.push(t, x, y)
+		# Every fixation is used once, as soon as it is long enough
+		if not self.fixation_used and t - self.fixation_start >= \
+			self.min_duration and self.window.variance() <= \
+			self.max_spread ** 2:
+			self.fixation_used = True
+			self.add_fixation(*self.window.mean())
+
+	def add_fixation(self, x, y):
+
+		"""
+		Updates the estimate with a fixation, if it is near a target
+
+		Arguments:
+		x -- the raw x coordinate of the fixation
+		y -- the raw y coordinate of the fixation
+
+		Returns:
+		True if the fixation was near a target, False otherwise
+		"""
+
+		# Targets are matched after correction, so that large but known drift
+		# does not prevent matching
+		cx, cy = self.correct(x, y)
+		best = None
+		for tx, ty in self.targets:
+			d = math.hypot(cx - tx, cy - ty)
+			if d <= self.capture_radius and (best == None or d < best[0]):
+				best = d, tx, ty
+		if best == None:
+			return False
+		d, tx, ty = best
+		residual = math.hypot(x - tx, y - ty)
+		if self.fixations == 0:
+			self.error = residual
+		else:
+			self.error = self.decay * self.error + (1 - self.decay) * residual
+		self.fixations += 1
+		for axis, r, t in [(0, x, tx), (1, y, ty)]:
+			s = self.sums[axis]
+			r -= self.center[axis]
+			t -= self.center[axis]
+			for i in range(5):
+				s[i] *= self.decay
+			s[0] += 1
+			s[1] += r
+			s[2] += t
+			s[3] += r * r
+			s[4] += r * t
+			# Least squares fit of t = gain * r + offset, with a prior on
+			# gain = 1
+			a11 = s[3] + self.gain_prior
+			a12 = s[1]
+			a22 = s[0]
+			b1 = s[4] + self.gain_prior
+			b2 = s[2]
+			det = a11 * a22 - a12 * a12
+			self.gain[axis] = min(1.25, max(.8, (b1 * a22 - a12 * b2) / det))
+			self.offset[axis] = (b2 - a12 * self.gain[axis]) / a22
+		return True
+
+	def correct(self, x, y):
+
+		"""
+		Corrects a gaze position
+
+		Arguments:
+		x -- the raw x coordinate
+		y -- the raw y coordinate
+
+		Returns:
+		A corrected (x, y) tuple. Missing data, (-1, -1), is not corrected.
+		"""
+
+		if (x, y) == (-1, -1):
+			return x, y
+		return self.center[0] + self.gain[0] * (x - self.center[0]) + \
+			self.offset[0], self.center[1] + self.gain[1] * (y - \
+			self.center[1]) + self.offset[1]
+
+class quality_monitor:
+
+	"""
+	Keeps track of the data quality of each trial: the percentage of samples #
+	without gaze position (track loss), the standard deviation of the #
+	intervals between samples (jitter), and the error of the last drift #
+	check.
+	"""
+
+	def __init__(self, resolution):
+
+		"""
+		Constructor
+
+		Arguments:
+		resolution -- the (width, height) of the display, outside of which #
+					  gaze is counted as lost
+		"""
+
+		self.resolution = resolution
+		self.drift_error = None
+		self.last_trial = None
+		self.start_trial()
+
+	def start_trial(self):
+
+		"""Starts counting for a new trial"""
+
+		self.samples = 0
+		self.lost = 0
+		self.last_time = None
+		# Welford's running mean and variance of the sample intervals
+		self.intervals = 0
+		self.interval_mean = 0.
+		self.interval_m2 = 0.
+
+	def add_sample(self, t, x, y):
+
+		"""
+		Counts a sample. Samples that have been counted before are ignored.
+
+		Arguments:
+		t -- the timestamp
+		x -- the x coordinate
+		y -- the y coordinate
+		"""
+
+		if self.last_time != None and t <= self.last_time:
+			return
+		self.samples += 1
+		if gaze_lost(x, y, self.resolution):
+			self.lost += 1
+		if self.last_time != None:
+			self.intervals += 1
+			delta = t - self.last_time - self.interval_mean
+			self.interval_mean += delta / self.intervals
+			self.interval_m2 += delta * (t - self.last_time - \
+				self.interval_mean)
+		self.last_time = t
+
+	def stop_trial(self):
+
+		"""
+		Ends a trial
+
+		Returns:
+		The quality of the trial, see libeyelink.recording_quality()
+		"""
+
+		if self.samples == 0:
+			return self.last_trial
+		self.last_trial = {
+			u'samples' : self.samples,
+			u'track_loss' : 100. * self.lost / self.samples,
+			u'interval' : self.interval_mean if self.intervals > 0 else None,
+			u'jitter' : math.sqrt(self.interval_m2 / self.intervals) \
+				if self.intervals > 0 else None,
+			u'drift_error' : self.drift_error
+			}
+		return self.last_trial
 
 class libeyelink:
 
 	MAX_TRY = 100
+	# The retry policy for starting recording: the delay after the first
+	# failure, the maximum delay, and the total time budget, all in
+	# milliseconds. The delay doubles after every failure, and is jittered to
+	# avoid retrying in lock-step with the tracker.
+	START_BACKOFF = 5
+	START_BACKOFF_MAX = 250
+	START_BUDGET = 2000
 
 
-	def __init__(self, experiment, resolution, data_file=u'default.edf', fg_color=(255, 255, 255), bg_color=(0, 0, 0), saccade_velocity_threshold=35, saccade_acceleration_threshold=9500, force_drift_correct=False):
+	def __init__(self, experiment, resolution, data_file=u'default.edf', fg_color=(255, 255, 255), bg_color=(0, 0, 0), saccade_velocity_threshold=35, saccade_acceleration_threshold=9500, force_drift_correct=False, link_profile=u'full', file_sample_data=u'GAZE,AREA,GAZERES,STATUS,HTARGET', file_event_filter=u'FIXATION,SACCADE,BLINK,MESSAGE,BUTTON', continuous_recording=False, pending_manifest=None, mirror_file=None, drift_estimation=False):
 		"""<DOC>
 		Constructor. Initializes the connection to the Eyelink.
 
@@ -71,28 +605,110 @@ class libeyelink:
 											only for Eyelink 1000 models, for #
 											which drift correction is disabled #
 											by default. (default=False)							   
+		link_profile	--	The data that is sent over the link: u'gaze', #
+							u'gaze+pupil', or u'full'. Lighter profiles #
+							reduce the link load, but pupil_size() requires #
+							u'gaze+pupil' or u'full'. (default=u'full')
+		file_sample_data	--	A comma-separated list of the sample fields #
+								that are stored in the EDF file. HTARGET #
+								is ignored on trackers that do not support #
+								it. (default=u'GAZE,AREA,GAZERES,STATUS,HTARGET')
+		file_event_filter	--	A comma-separated list of the event types #
+								that are stored in the EDF file. #
+								(default=u'FIXATION,SACCADE,BLINK,MESSAGE,BUTTON')
+		continuous_recording	--	Indicates whether the tracker should keep #
+									recording between trials. If so, #
+									start_recording() and stop_recording() #
+									only mark the start and end of a trial #
+									with TRIALID and TRIAL_RESULT messages, #
+									and the tracker only stops recording for #
+									calibration, drift correction, and when #
+									the connection is closed. (default=False)
+		pending_manifest	--	The path to a transfer manifest, or None. #
+								If specified, data files are not received #
+								when they are closed, but are added to the #
+								manifest, so that they can be received #
+								later with eyelink_fetch.py. (default=None)
+		mirror_file		--	The path of a local file to which all link #
+							samples and events are appended while #
+							recording, or None. The link is read by #
+							sample(), pupil_size(), the wait_for_[...]() #
+							functions, log(), and stop_recording(). If #
+							none of these is called for longer than the #
+							link queue holds, samples are lost, and the #
+							gaps are counted in the file. See #
+							read_mirror() and mirror_gaps(). #
+							(default=None)
+		drift_estimation	--	Indicates whether drift is estimated from #
+								fixations on targets that are registered #
+								with add_fixation_target(), and corrected #
+								in sample() and the wait_for_[...]() #
+								functions. (default=False)
 
 		Returns:
 		True on connection success and False on connection failure.
 		</DOC>"""
 
-		global _eyelink
+		global _eyelink, _graphics
 
 		stem, ext = os.path.splitext(data_file)
 		if len(stem) > 8 or len(ext) > 4:
 			raise exceptions.runtime_error( \
 				u'The Eyelink cannot handle filenames longer than 8 characters (plus .EDF extension)')
 
+		if link_profile not in LINK_PROFILES:
+			raise exceptions.runtime_error( \
+				u'Unknown link data profile: %s' % link_profile)
+
+		# Opening the data file would overwrite a file on the tracker that has
+		# not been received yet
+		if pending_manifest != None and is_pending(pending_manifest, \
+			data_file):
+			raise exceptions.runtime_error( \
+				u'%s is still on the tracker and has not been received yet. Please receive it with eyelink_fetch.py first, or use a different logfile name.' \
+				% data_file)
+
 		self.experiment = experiment
 		self.data_file = data_file
+		self.data_file_stem = stem
+		self.block_nr = 0
+		self.transfers = []
+		self.pending_manifest = pending_manifest
+		if mirror_file != None:
+			self.link_mirror = link_mirror(mirror_file)
+		else:
+			self.link_mirror = None
+		if drift_estimation:
+			self.drift_estimator = drift_estimator((resolution[0] / 2, \
+				resolution[1] / 2))
+		else:
+			self.drift_estimator = None
+		self.quality_monitor = None
+		# Indicates whether link data is read as it arrives
+		self.drain_link = self.link_mirror != None
 		self.resolution = resolution
+		self.link_profile = link_profile
+		self.file_sample_data = [field for field in \
+			file_sample_data.split(u',') if field != u'']
+		self.file_event_filter = [field for field in \
+			file_event_filter.split(u',') if field != u'']
+		# Fields that are not sent over the link are not decoded
+		self.link_has_pupil = u'AREA' in \
+			LINK_PROFILES[link_profile][u'link_sample_data'].split(u',')
 		self.recording = False
+		self.continuous_recording = continuous_recording
+		self.tracker_recording = False
+		self.trial_id = 0
 		self.cal_beep = True
 		self.cal_target_size = 16		
+		self.auto_calibration_enabled = False
 		self.experiment.eyelink_esc_pressed = False
-		self.saccade_velocity_treshold = saccade_velocity_threshold
-		self.saccade_acceleration_treshold = saccade_acceleration_threshold
+		self.saccade_velocity_threshold = saccade_velocity_threshold
+		self.saccade_acceleration_threshold = saccade_acceleration_threshold
 		self.eye_used = None
+		self.conf_canvas = None
+		self.wait_times = {}
+		self.recording_status = None
 		self.left_eye = 0
 		self.right_eye = 1
 		self.binocular = 2
@@ -100,13 +716,13 @@ class libeyelink:
 		# Only initialize the eyelink once
 		if _eyelink == None:
 			try:
-				_eyelink = pylink.EyeLink()
-			except Exception as e:
-				raise exceptions.runtime_error( \
-					u'Failed to connect to the tracker: %s' % e)					
+				_eyelink = connect()
+			except RuntimeError as e:
+				raise exceptions.runtime_error(u'%s' % e)
+			self.invalidate_tracker_state()
 
-			graphics_env = eyelink_graphics(self.experiment, _eyelink)
-			pylink.openGraphicsEx(graphics_env)				
+			_graphics = eyelink_graphics(self.experiment, _eyelink)
+			pylink.openGraphicsEx(_graphics)				
 			
 		# Optionally force drift correction. For some reason this must be done
 		# as (one of) the first thingsm otherwise a segmentation fault occurs.
@@ -117,56 +733,19 @@ class libeyelink:
 		pylink.flushGetkeyQueue()
 		pylink.getEYELINK().setOfflineMode()
 
-		# Notify the eyelink of the display resolution
-		self.send_command('screen_pixel_coords =  0 0 %d %d' % ( \
-			self.resolution[0], self.resolution[1]))
-
 		# Determine the software version of the tracker
-		self.tracker_software_ver = 0
 		self.eyelink_ver = pylink.getEYELINK().getTrackerVersion()
+		self.tracker_software_ver = 0
 		if self.eyelink_ver == 3:
-			tvstr = pylink.getEYELINK().getTrackerVersionString()
-			vindex = tvstr.find("EYELINK CL")
-			self.tracker_software_ver = int(float(tvstr[(vindex + \
-				len("EYELINK CL")):].strip()))
-
-		# Some configuration stuff (not sure what the parser and gazemap mean)
-		if self.eyelink_ver >= 2:
-			self.send_command("select_parser_configuration 0")
-			if self.eyelink_ver == 2: #turn off scenelink camera stuff
-				self.send_command("scene_camera_gazemap = NO")
-		else:
-			self.send_command("saccade_velocity_threshold = %d" % \
-				self.saccade_velocity_threshold)
-			self.send_command("saccade_acceleration_threshold = %s" % \
-				self.saccade_acceleration_threshold)
-
-		# Set EDF file contents
-		self.send_command( \
-			"file_event_filter = LEFT,RIGHT,FIXATION,SACCADE,BLINK,MESSAGE,BUTTON")
-		if self.tracker_software_ver >= 4:
-			self.send_command( \
-				"file_sample_data  = LEFT,RIGHT,GAZE,AREA,GAZERES,STATUS,HTARGET")
-		else:
-			self.send_command( \
-				"file_sample_data  = LEFT,RIGHT,GAZE,AREA,GAZERES,STATUS")
+			m = re.search(r'EYELINK CL\s+([\d.]+)', \
+				pylink.getEYELINK().getTrackerVersionString())
+			if m != None:
+				self.tracker_software_ver = int(float(m.group(1)))
 
-		# Set link data. This specifies which data is sent through the link and
-		# thus be used in gaze contingent displays
-		self.send_command( \
-			"link_event_filter = LEFT,RIGHT,FIXATION,SACCADE,BLINK,BUTTON")
-		self.send_command( \
-			"link_event_data = GAZE,GAZERES,HREF,AREA,VELOCITY,STATUS")
-		if self.tracker_software_ver >= 4:
-			self.send_command( \
-				"link_sample_data  = LEFT,RIGHT,GAZE,GAZERES,AREA,STATUS,HTARGET")
-		else:
-			self.send_command( \
-				"link_sample_data  = LEFT,RIGHT,GAZE,GAZERES,AREA,STATUS")				
-
-		# Not sure what this means. Maybe the button that is used to end drift
-		# correction?
-		self.send_command("button_function 5 'accept_target_fixation'")
+		# Configure the tracker in a single batch
+		self.config = self.config_profile()
+		self.validate_config(self.config)
+		self.send_config(self.config)
 
 		# Make sure that we are connected to the eyelink before we start
 		# further communication
@@ -174,6 +753,12 @@ class libeyelink:
 			raise exceptions.runtime_error( \
 				"Failed to connect to the eyetracker")
 
+		# Keep references to the functions that are used while recording, to
+		# avoid looking them up on every call
+		self.get_newest_sample = pylink.getEYELINK().getNewestSample
+		self.get_next_data = pylink.getEYELINK().getNextData
+		self.get_float_data = pylink.getEYELINK().getFloatData
+
 		# TODO: The code below potentially fixes a bug, but - pending a more
 		# thorough understanding - has been disabled to avoid regressions and
 		# other problems. Discussions on this issue can be found here:
@@ -197,17 +782,158 @@ class libeyelink:
 		#if not utd:
 			#self.wait_for_saccade_start = self.__wait_for_saccade_start_pre_10028
 
-	def send_command(self, cmd):
+	def config_profile(self):
+
+		"""<DOC>
+		Gets the tracker configuration for the connected tracker.
+
+		Returns:
+		A list of (setting, value) tuples.
+		</DOC>"""
+
+		config = [(u'screen_pixel_coords', u'0 0 %d %d' % \
+			(self.resolution[0], self.resolution[1]))]
+		# Some configuration stuff (not sure what the parser and gazemap mean)
+		if self.eyelink_ver >= 2:
+			config.append((u'select_parser_configuration', u'0'))
+			if self.eyelink_ver == 2: #turn off scenelink camera stuff
+				config.append((u'scene_camera_gazemap', u'NO'))
+		else:
+			config.append((u'saccade_velocity_threshold', u'%d' % \
+				self.saccade_velocity_threshold))
+			config.append((u'saccade_acceleration_threshold', u'%d' % \
+				self.saccade_acceleration_threshold))
+		# The HTARGET field is only supported by newer trackers
+		if self.tracker_software_ver >= 4:
+			htarget = u',HTARGET'
+		else:
+			htarget = u''
+		# Set EDF file contents
+		config.append((u'file_event_filter', u','.join([u'LEFT', \
+			u'RIGHT'] + self.file_event_filter)))
+		config.append((u'file_sample_data', u','.join([u'LEFT', u'RIGHT'] \
+			+ [field for field in self.file_sample_data if field != \
+			u'HTARGET' or self.tracker_software_ver >= 4])))
+		# Set link data. This specifies which data is sent through the link and
+		# thus be used in gaze contingent displays
+		link_profile = LINK_PROFILES[self.link_profile]
+		config.append((u'link_event_filter', \
+			link_profile[u'link_event_filter']))
+		config.append((u'link_event_data', link_profile[u'link_event_data']))
+		if self.link_profile == u'full':
+			config.append((u'link_sample_data', \
+				link_profile[u'link_sample_data'] + htarget))
+		else:
+			config.append((u'link_sample_data', \
+				link_profile[u'link_sample_data']))
+		# Not sure what this means. Maybe the button that is used to end drift
+		# correction?
+		config.append((u'button_function', u"5 'accept_target_fixation'"))
+		return config
+
+	def validate_config(self, config):
 
 		"""<DOC>
-		Sends a command to the eyelink.
+		Checks a tracker configuration before it is sent to the tracker.
+
+		Arguments:
+		config	--	A list of (setting, value) tuples.
+
+		Exceptions:
+		Raises an exceptions.runtime_error if the configuration is invalid.
+		</DOC>"""
+
+		for setting, value in config:
+			if setting not in CONFIG_SETTINGS:
+				raise exceptions.runtime_error( \
+					u'Unknown tracker setting: %s' % setting)
+			if setting not in FIELD_SETTINGS:
+				continue
+			for field in value.split(u','):
+				if field not in FIELD_SETTINGS[setting]:
+					raise exceptions.runtime_error( \
+						u'Invalid field for tracker setting %s: %s' % \
+						(setting, field))
+				if field == u'HTARGET' and self.tracker_software_ver < 4:
+					raise exceptions.runtime_error( \
+						u'HTARGET requires tracker software version 4 or later')
+
+	def send_config(self, config, timeout=1000):
+
+		"""<DOC>
+		Sends a tracker configuration to the tracker. The commands are sent #
+		without waiting for the tracker in between. Because the tracker #
+		processes commands in order, a single read-back of link_sample_data #
+		at the end confirms that the entire batch has been processed.
+
+		Arguments:
+		config	--	A list of (setting, value) tuples.
+
+		Keyword arguments:
+		timeout	--	The maximum time in milliseconds to wait for the #
+					tracker to confirm the configuration. (default=1000)
+
+		Exceptions:
+		Raises an exceptions.runtime_error if the tracker does not confirm #
+		the configuration.
+		</DOC>"""
+
+		for setting, value in config:
+			self.send_command(u'%s = %s' % (setting, value))
+		expected = dict(config).get(u'link_sample_data')
+		if expected == None:
+			return
+		pylink.getEYELINK().readRequest(u'link_sample_data')
+		t0 = self.experiment.time()
+		while True:
+			reply = pylink.getEYELINK().readReply()
+			if reply:
+				break
+			if self.experiment.time() - t0 > timeout:
+				raise exceptions.runtime_error( \
+					u'The tracker did not confirm the configuration')
+			pylink.msecDelay(1)
+		fields = set(reply.replace(u' ', u'').upper().split(u','))
+		if fields != set(expected.split(u',')):
+			raise exceptions.runtime_error( \
+				u'The tracker configuration was not applied (link_sample_data = %s)' \
+				% reply)
+
+	def send_command(self, cmd, force=False):
+
+		"""<DOC>
+		Sends a command to the eyelink. Commands that set a tracker setting #
+		to the value that is already in effect are skipped.
 
 		Arguments:
 		cmd		--	The eyelink command to be executed.
+
+		Keyword arguments:
+		force	--	Indicates whether the command should be sent even if #
+					the setting already has the requested value. #
+					(default=False)
 		</DOC>"""
 
+		self.finish_transfers()
+		m = re.match(r'\s*(\w+)\s*=?\s*(.*?)\s*$', cmd)
+		if m != None and m.group(1) in CACHED_SETTINGS:
+			setting = m.group(1)
+			value = u' '.join(m.group(2).split())
+			if not force and _tracker_state.get(setting) == value:
+				return
+			_tracker_state[setting] = value
 		pylink.getEYELINK().sendCommand(cmd)
 
+	def invalidate_tracker_state(self):
+
+		"""<DOC>
+		Forgets which settings are in effect on the tracker, so that all #
+		subsequent commands are sent. This is necessary whenever settings may #
+		have been changed without send_command(), such as during set-up.
+		</DOC>"""
+
+		_tracker_state.clear()
+
 	def log(self, msg):
 
 		"""<DOC>
@@ -217,6 +943,7 @@ class libeyelink:
 		msg		--	The message to be logged.
 		</DOC>"""
 		
+		self.finish_transfers()
 		# sendMessage() is not Unicode safe, so we need to strip all Unicode
 		# characters from the message
 		if type(msg) == unicode:
@@ -224,6 +951,9 @@ class libeyelink:
 		if type(msg) == str:
 			msg = msg.decode('ascii','ignore')
 		pylink.getEYELINK().sendMessage(msg)
+		# The link is read after the message, so that this does not delay it
+		if self.drain_link and self.tracker_recording:
+			self.drain_link_data()
 
 	def log_var(self, var, val):
 
@@ -236,6 +966,7 @@ class libeyelink:
 		val		-- The value.
 		</DOC>"""
 
+		self.finish_transfers()
 		pylink.getEYELINK().sendMessage("var %s %s" % (var, val))
 
 	def status_msg(self, msg):
@@ -248,7 +979,7 @@ class libeyelink:
 		msg		--	The status message.
 		</DOC>"""
 
-		pylink.getEYELINK().sendCommand("record_status_message '%s'" % msg)
+		self.send_command("record_status_message '%s'" % msg)
 
 	def connected(self):
 
@@ -261,7 +992,9 @@ class libeyelink:
 
 		return pylink.getEYELINK().isConnected()
 
-	def calibrate(self, beep=True, target_size=16):
+	def calibrate(self, beep=True, target_size=16, auto_pacing=False, \
+		pacing_interval=1000, max_validation_error=0.5, participant=None, \
+		profile_file=None, max_profile_age=60):
 
 		"""<DOC>
 		Starts eyelink calibration.
@@ -270,6 +1003,26 @@ class libeyelink:
 		beep			--	Indicates whether or not the calibration target #
 							should beep when jumping. (default=True)
 		target_size		--	The size of the calibration target. (default=16)
+		auto_pacing		--	Indicates whether calibration should be auto- #
+							paced. If so, targets are accepted automatically #
+							once the eye is stable, validation starts right #
+							after a successful calibration, and set-up is #
+							left automatically when validation is good #
+							enough. (default=False)
+		pacing_interval	--	The minimum time between automatically #
+							accepted targets in milliseconds. #
+							(default=1000)
+		max_validation_error	--	The maximum average validation error #
+									in degrees for set-up to be left #
+									automatically. (default=0.5)
+		participant		--	A participant ID. If this and profile_file are #
+							specified, a recent calibration of the same #
+							participant is reused if it passes a drift #
+							check. (default=None)
+		profile_file	--	The file in which calibration profiles are #
+							stored. (default=None)
+		max_profile_age	--	The maximum age in minutes of a calibration #
+							profile that is reused. (default=60)
 
 		Exceptions:
 		Raises an exceptions.runtime_error on failure.
@@ -278,19 +1031,146 @@ class libeyelink:
 		if self.recording:
 			raise exceptions.runtime_error( \
 				u'Trying to calibrate after recording has started')
+		self.finish_transfers()
+		if self.tracker_recording:
+			self.stop_tracker_recording()
 
 		self.cal_beep = beep
 		self.cal_target_size = target_size
+		use_profile = participant != None and profile_file != None
+		if use_profile and self.reuse_calibration(participant, profile_file, \
+			max_profile_age):
+			return
+		_graphics.validation_result = None
+		# The setting persists on the tracker, so if auto-pacing was turned on
+		# earlier in this session, it is turned off again. Otherwise, the
+		# setting of the host is left alone.
+		if auto_pacing:
+			self.send_command('enable_automatic_calibration = YES')
+			self.send_command('automatic_calibration_pacing = %d' % \
+				pacing_interval)
+			self.auto_calibration_enabled = True
+		elif self.auto_calibration_enabled:
+			self.send_command('enable_automatic_calibration = NO')
+			self.auto_calibration_enabled = False
+		_graphics.set_auto_pacing(auto_pacing, max_validation_error)
 
 		# attempt calibrate; confirm abort when esc pressed
 		while True:
 			pylink.getEYELINK().doTrackerSetup()
+			self.invalidate_tracker_state()
 			if not self.experiment.eyelink_esc_pressed: 
 				break
 			else:
 				self.confirm_abort_experiment()
 				self.experiment.eyelink_esc_pressed = False
+		if use_profile:
+			self.save_calibration_profile(participant, profile_file, \
+				max_validation_error)
+		if self.drift_estimator != None:
+			self.drift_estimator.reset()
+
+	def load_calibration_profiles(self, profile_file):
+
+		"""
+		Reads calibration profiles from file.
+
+		Arguments:
+		profile_file	--	The file in which calibration profiles are stored.
+
+		Returns:
+		A dict with a 'last' key, which contains the ID of the participant #
+		that was calibrated last, and a 'profiles' key, which maps #
+		participant IDs onto profiles.
+		"""
+
+		if not os.path.exists(profile_file):
+			return {u'last' : None, u'profiles' : {}}
+		try:
+			with open(profile_file) as fd:
+				return json.load(fd)
+		except Exception as e:
+			print u'libeyelink: failed to read calibration profiles: %s' % e
+			return {u'last' : None, u'profiles' : {}}
+
+	def save_calibration_profile(self, participant, profile_file, \
+		max_validation_error=0.5):
+
+		"""<DOC>
+		Stores the result of the last calibration for a participant. If set-up #
+		was left without a sufficiently accurate validation, the tracker may #
+		not hold a usable calibration, so no profile is stored, and no #
+		calibration can be reused until the next one.
+
+		Arguments:
+		participant				--	The participant ID.
+		profile_file			--	The file in which calibration profiles #
+									are stored.
+
+		Keyword arguments:
+		max_validation_error	--	The maximum average validation error in #
+									degrees. (default=0.5)
+		</DOC>"""
+
+		participant = unicode(participant)
+		profiles = self.load_calibration_profiles(profile_file)
+		validation = _graphics.validation_result
+		if validation == None or validation[0] > max_validation_error:
+			profiles[u'last'] = None
+			profiles[u'profiles'].pop(participant, None)
+		else:
+			profiles[u'last'] = participant
+			profiles[u'profiles'][participant] = {
+				u'time' : time.time(),
+				u'validation' : validation,
+				u'data_file' : self.data_file
+				}
+		try:
+			with open(profile_file, u'w') as fd:
+				json.dump(profiles, fd, indent=1)
+		except Exception as e:
+			print u'libeyelink: failed to save calibration profile: %s' % e
+
+	def reuse_calibration(self, participant, profile_file, max_age=60):
+
+		"""<DOC>
+		Checks whether the calibration of a participant can be reused. This is #
+		the case when the participant was the last to be calibrated, no more #
+		than max_age minutes ago, the calibration was validated, and a drift #
+		check at the display center succeeds.
+
+		Arguments:
+		participant		--	The participant ID.
+		profile_file	--	The file in which calibration profiles are stored.
+
+		Keyword arguments:
+		max_age			--	The maximum age of the calibration in minutes. #
+							(default=60)
 
+		Returns:
+		True if the calibration was reused, False otherwise.
+		</DOC>"""
+
+		participant = unicode(participant)
+		profiles = self.load_calibration_profiles(profile_file)
+		# The tracker only holds the calibration of the participant that was
+		# calibrated last
+		if profiles[u'last'] != participant:
+			return False
+		profile = profiles[u'profiles'].get(participant)
+		if profile == None or profile[u'validation'] == None or \
+			time.time() - profile[u'time'] > 60 * max_age:
+			return False
+		pos = self.resolution[0] / 2, self.resolution[1] / 2
+		_graphics.target_canvas(pos[0], pos[1]).show()
+		if not self.drift_correction(pos):
+			print u'libeyelink.reuse_calibration(): drift check failed'
+			return False
+		print u'libeyelink.reuse_calibration(): reusing calibration of %s' \
+			% participant
+		self.log_var(u'calibration_reused', participant)
+		_graphics.validation_result = profile[u'validation']
+		return True
 
 	def get_eyelink_clock_async(self):
 
@@ -333,9 +1213,37 @@ class libeyelink:
 		if self.recording:
 			raise exceptions.runtime_error( \
 				u'Trying to do drift correction after recording has started')
+		self.finish_transfers()
+		if self.tracker_recording:
+			self.stop_tracker_recording()
 		if fix_triggered:
-			return self.fix_triggered_drift_correction(pos)
-		return self.manual_drift_correction(pos)
+			success = self.fix_triggered_drift_correction(pos)
+		else:
+			success = self.manual_drift_correction(pos)
+		# The tracker has corrected the drift, so the estimate starts over
+		if success and self.drift_estimator != None:
+			self.drift_estimator.reset()
+		if success and self.quality_monitor != None:
+			self.quality_monitor.drift_error = self.drift_correction_error()
+		return success
+
+	def drift_correction_error(self):
+
+		"""<DOC>
+		Gets the error of the last drift correction from the tracker.
+
+		Returns:
+		The error in degrees, or None if it is not available.
+		</DOC>"""
+
+		try:
+			msg = pylink.getEYELINK().getCalibrationMessage()
+		except:
+			return None
+		m = re.search(r'OFFSET\s+(-?[\d.]+)\s+deg', msg)
+		if m == None:
+			return None
+		return abs(float(m.group(1)))
 
 	def prepare_drift_correction(self, pos):
 
@@ -359,7 +1267,7 @@ class libeyelink:
 			raise exceptions.runtime_error( \
 				u'Failed to perform drift correction (waitForBlockStart error)')
 
-	def fix_triggered_drift_correction(self, pos=None, min_samples=30, max_dev=60, reset_threshold=10):
+	def fix_triggered_drift_correction(self, pos=None, min_samples=30, max_dev=60, reset_threshold=10, window=30, max_outliers=2):
 
 		"""<DOC>
 		Performs fixation triggered drift correction. You can return to the #
@@ -367,14 +1275,28 @@ class libeyelink:
 		during drift-correction will not immediately abort the experiment, but #
 		will ask for confirmation first.
 
+		Drift correction is triggered when the gaze has been stable for at #
+		least `window` ms and `min_samples` samples, and the mean gaze #
+		position is within `max_dev` pixels of the reference point. Each new #
+		sample is only used once. A sample that deviates more than #
+		`reset_threshold` from the mean of the current fixation is ignored, #
+		but more than `max_outliers` such samples in a row (a saccade or a #
+		blink) start a new fixation.
+
 		Keyword arguments:
 		pos				--	The coordinate (x,y tuple) for drift correction #
 							or None for the display center. (default=None)
 		min_samples		--	The minimum nr of stable samples that should be #
 							acquired. (default=30)
-		max_dev			--	The maximum allowed deviation. (default=60)
-		reset_threshold	--	The maximum allowed deviation from one sample to #
-							the next (default=10)
+		max_dev			--	The maximum allowed deviation of the fixation #
+							from the reference point. (default=60)
+		reset_threshold	--	The maximum allowed deviation of a sample from #
+							the mean of the fixation (default=10)
+		window			--	The minimum duration of the fixation in ms. Only #
+							samples from the last `window` ms are averaged. #
+							(default=30)
+		max_outliers	--	The number of deviating samples in a row that is #
+							tolerated. (default=2)
 
 		Returns:
 		True on success, False on failure.
@@ -391,12 +1313,17 @@ class libeyelink:
 		if pos == None:
 			pos = self.resolution[0] / 2, self.resolution[1] / 2
 		self.prepare_drift_correction(pos)
+		if self.eye_used == None:
+			self.set_eye_used()
 		my_keyboard = keyboard(self.experiment, keylist=[u'escape', u'q'], \
 			timeout=0)
-		# Loop until we have sufficient samples
-		lx = []
-		ly = []
-		while len(lx) < min_samples:
+		# Room for the window at up to 2000 Hz
+		fixation = running_window(max(min_samples, 2 * window + 1), window, pos)
+		fixation_start = None
+		fixation_samples = 0
+		outliers = 0
+		last_time = None
+		while True:
 			# Pressing escape enters the calibration screen
 			try:
 				key,time = my_keyboard.get_key()
@@ -411,37 +1338,52 @@ class libeyelink:
 					self.recording = False
 					print u'libeyelink.fix_triggered_drift_correction(): \'q\' pressed'
 					return False
-			# Collect a sample
-			x, y = self.sample()
-			if len(lx) == 0 or x != lx[-1] or y != ly[-1]:
-				# If the current sample deviates too much from the previous one,
-				# reset counting
-				if len(lx) > 0 and (abs(x - lx[-1]) > reset_threshold or abs(y - ly[-1]) > reset_threshold):
-					lx = []
-					ly = []
-				# Collect samples
-				else:
-					lx.append(x)
-					ly.append(y)
-			if len(lx) == min_samples:
-				avg_x = sum(lx) / len(lx)
-				avg_y = sum(ly) / len(ly)
-				d = math.sqrt( (avg_x - pos[0]) ** 2 + (avg_y - pos[1]) ** 2)
-				# Emulate a spacebar press on success
-				pylink.getEYELINK().sendKeybutton(32, 0, pylink.KB_PRESS)
-				# getCalibrationResult() returns 0 on success and an exception
-				# or a non-zero value otherwise
-				result = -1
-				try:
-					result = pylink.getEYELINK().getCalibrationResult()
-				except:
-					lx = []
-					ly = []
-					print u'libeyelink.fix_triggered_drift_correction(): try again'
-				if result != 0:
-					lx = []
-					ly = []
-					print u'libeyelink.fix_triggered_drift_correction(): try again'
+			# Only use new samples, and don't poll the tracker at full speed
+			# while waiting for one
+			s = self.get_newest_sample()
+			t = s.getTime() if s != None else None
+			if t == None or t == last_time:
+				pylink.msecDelay(1)
+				continue
+			last_time = t
+			x, y = self.sample_gaze(s)
+			if (x, y) != (-1, -1) and len(fixation) > 0:
+				mx, my = fixation.mean()
+				valid = abs(x - mx) <= reset_threshold and \
+					abs(y - my) <= reset_threshold
+			else:
+				valid = (x, y) != (-1, -1)
+			if not valid:
+				outliers += 1
+				if outliers > max_outliers:
+					fixation.clear()
+					outliers = 0
+				continue
+			outliers = 0
+			if len(fixation) == 0:
+				fixation_start = t
+				fixation_samples = 0
+			fixation.push(t, x, y)
+			fixation_samples += 1
+			if fixation_samples < min_samples or t - fixation_start < window:
+				continue
+			# The gaze is stable, but should also be on the reference point
+			avg_x, avg_y = fixation.mean()
+			if math.hypot(avg_x - pos[0], avg_y - pos[1]) > max_dev:
+				continue
+			# Emulate a spacebar press on success
+			pylink.getEYELINK().sendKeybutton(32, 0, pylink.KB_PRESS)
+			# getCalibrationResult() returns 0 on success and an exception
+			# or a non-zero value otherwise
+			result = -1
+			try:
+				result = pylink.getEYELINK().getCalibrationResult()
+			except:
+				pass
+			if result == 0:
+				break
+			fixation.clear()
+			print u'libeyelink.fix_triggered_drift_correction(): try again'
 		# Apply drift correction
 		pylink.getEYELINK().applyDriftCorrect()
 		self.recording = False
@@ -493,65 +1435,463 @@ class libeyelink:
 		self.experiment.eyelink_esc_pressed = False
 		return False
 
-	def start_recording(self):
+	def start_recording(self):
+
+		"""<DOC>
+		Starts recording of gaze samples. In continuous-recording mode, the #
+		tracker is only started if it is not recording already, and the start #
+		of the trial is marked with a TRIALID message.
+
+		Exceptions:
+		Raises an exceptions.runtime_error on failure.
+		</DOC>"""
+
+		if not self.tracker_recording:
+			self.start_tracker_recording()
+		else:
+			self.warm_up()
+		self.recording = True
+		if self.quality_monitor != None:
+			self.quality_monitor.start_trial()
+		if self.continuous_recording:
+			self.trial_id += 1
+			self.log(u'TRIALID %d' % self.trial_id)
+
+	def start_tracker_recording(self):
+
+		"""<DOC>
+		Puts the tracker in recording mode. Usually, you should call #
+		start_recording() instead.
+
+		Exceptions:
+		Raises an exceptions.runtime_error on failure.
+		</DOC>"""
+
+		self.finish_transfers()
+		status = recording_status()
+		self.recording_status = status
+		t0 = self.experiment.time()
+		delay = self.START_BACKOFF
+		while True:
+			status.attempts += 1
+			# Params: write  samples, write event, send samples, send events
+			try:
+				error = pylink.getEYELINK().startRecording(1, 1, 1, 1)
+			except Exception as e:
+				error = e
+			status.elapsed = self.experiment.time() - t0
+			if not isinstance(error, Exception) and not error:
+				break
+			retry = status.add_failure(status.elapsed, error)
+			if not retry or status.attempts >= self.MAX_TRY or \
+				status.elapsed + delay > self.START_BUDGET:
+				raise exceptions.runtime_error(u'%s' % status)
+			pylink.msecDelay(int(delay * random.uniform(.5, 1.)))
+			delay = min(2 * delay, self.START_BACKOFF_MAX)
+		status.success = True
+		self.tracker_recording = True
+		# Don't know what this is
+		pylink.pylink.beginRealTimeMode(100)
+		# Wait for a bit until samples start coming in (I think?)
+		if not pylink.getEYELINK().waitForBlockStart(100, 1, 0):
+			raise exceptions.runtime_error( \
+				u'Failed to start recording (waitForBlockStart error)')
+		self.warm_up()
+
+	def warm_up(self):
+
+		"""<DOC>
+		Prepares for the time-critical phase of a recording, so that the #
+		first sample() and wait_for_[...]() calls are as fast as later calls. #
+		This determines which eye is recorded, discards link data that #
+		arrived before recording started (after passing it to the mirror file #
+		and the quality monitor, if these are used), and decodes a first #
+		sample. This function is called automatically by start_recording().
+		</DOC>"""
+
+		self.set_eye_used()
+		# Between trials in continuous-recording mode, the link data still
+		# belongs in the mirror file
+		if self.drain_link:
+			self.drain_link_data()
+		else:
+			while self.get_next_data() != 0:
+				pass
+		self.get_eyelink_clock_async()
+		# sample() cannot be used here, because recording is only flagged as
+		# started after the warm-up
+		self.sample_gaze(self.get_newest_sample())
+
+	def stop_recording(self):
+
+		"""<DOC>
+		Stops recording of gaze samples. In continuous-recording mode, the #
+		tracker keeps recording, and the end of the trial is marked with a #
+		TRIAL_RESULT message.
+		</DOC>"""
+
+		self.recording = False
+		if self.drain_link:
+			self.drain_link_data()
+		if self.quality_monitor != None:
+			self.quality_monitor.stop_trial()
+		if self.continuous_recording:
+			self.log(u'TRIAL_RESULT 0')
+			return
+		self.stop_tracker_recording()
+
+	def stop_tracker_recording(self):
+
+		"""<DOC>
+		Takes the tracker out of recording mode. Usually, you should call #
+		stop_recording() instead.
+		</DOC>"""
+
+		self.tracker_recording = False
+		if self.link_mirror != None:
+			self.link_mirror.pause()
+		pylink.endRealTimeMode()
+		pylink.getEYELINK().setOfflineMode()
+		self.wait_for_condition(self.tracker_idle, 500, u'stop_recording')
+
+	def tracker_idle(self):
+
+		"""<DOC>
+		Checks whether the tracker is in offline (idle) mode.
+
+		Returns:
+		True if the tracker is idle, False otherwise.
+		</DOC>"""
+
+		return pylink.getEYELINK().getCurrentMode() & pylink.IN_IDLE_MODE != 0
+
+	def drain_link_data(self):
+
+		"""<DOC>
+		Passes all link data that has arrived since the last call to the #
+		mirror file and the quality monitor. This is called automatically by #
+		sample(), pupil_size(), wait_for_event(), log(), and #
+		stop_recording() when a mirror file has been specified or the #
+		quality monitor is enabled. Link data that does not fit in the link #
+		queue before one of these is called is lost. The data is removed from #
+		the link queue, but this does not affect wait_for_event(), which #
+		ignores events that occurred before it was called.
+		</DOC>"""
+
+		while True:
+			d = self.get_next_data()
+			if d == 0:
+				break
+			self.handle_link_data(d, self.get_float_data())
+
+	def handle_link_data(self, d, data):
+
+		"""<DOC>
+		Passes a sample or event to the mirror file and the quality monitor.
+
+		Arguments:
+		d		--	The data type, as returned by getNextData().
+		data	--	The float data.
+		</DOC>"""
+
+		if self.link_mirror != None:
+			self.link_mirror.record(d, data)
+		if self.quality_monitor != None and d == pylink.SAMPLE_TYPE:
+			x, y = self.sample_gaze(data)
+			self.quality_monitor.add_sample(data.getTime(), x, y)
+
+	def enable_quality_monitor(self):
+
+		"""<DOC>
+		Starts monitoring the data quality of each trial. See #
+		recording_quality(). The monitor sees the samples that are read from #
+		the link by drain_link_data(). Samples that are lost because the link #
+		was not read for too long show up as jitter.
+		</DOC>"""
+
+		if self.quality_monitor == None:
+			self.quality_monitor = quality_monitor(self.resolution)
+			self.drain_link = True
+
+	def recording_quality(self):
+
+		"""<DOC>
+		Gets the data quality of the last trial. The quality monitor must #
+		have been enabled with enable_quality_monitor().
+
+		Returns:
+		None if no trial has been monitored yet, or a dict with the keys #
+		u'samples', u'track_loss' (the percentage of samples without gaze #
+		position), u'interval' (the mean interval between samples in ms), #
+		u'jitter' (the standard deviation of the intervals in ms), and #
+		u'drift_error' (the error of the last drift correction in degrees). #
+		Values that are not available are None.
+		</DOC>"""
+
+		if self.quality_monitor == None:
+			return None
+		return self.quality_monitor.last_trial
+
+	def wait_for_condition(self, condition, timeout, label):
+
+		"""<DOC>
+		Waits until a condition is met, or until a timeout occurs. How long #
+		the wait took is stored in the wait_times dict under the label, as a #
+		list of durations in milliseconds.
+
+		Arguments:
+		condition	--	A function that returns True when the condition is #
+						met.
+		timeout		--	The maximum time to wait in milliseconds.
+		label		--	A label that identifies the wait.
+
+		Returns:
+		True if the condition was met, False on a timeout.
+		</DOC>"""
+
+		t0 = self.experiment.time()
+		while not condition():
+			if self.experiment.time() - t0 >= timeout:
+				print u'libeyelink.wait_for_condition(): %s timed out after %d ms' \
+					% (label, timeout)
+				met = False
+				break
+			pylink.msecDelay(1)
+		else:
+			met = True
+		if label not in self.wait_times:
+			self.wait_times[label] = []
+		self.wait_times[label].append(self.experiment.time() - t0)
+		return met
+
+	def close(self):
+
+		"""<DOC>
+		Closes the connection with the eyelink.
+		</DOC>"""
+
+		global _eyelink, _graphics
+
+		if self.recording:
+			self.stop_recording()
+		if self.tracker_recording:
+			self.stop_tracker_recording()
+		# Finish receiving data files of previous blocks
+		self.wait_for_transfers()
+		# Close the datafile and transfer it to the experimental pc
+		print u'libeyelink: closing data file'
+		pylink.getEYELINK().closeDataFile()
+		if self.pending_manifest != None:
+			print u'libeyelink: deferring transfer of data file'
+			add_pending_file(self.pending_manifest, self.data_file, \
+				self.data_file)
+		else:
+			print u'libeyelink: transferring data file'
+			self.receive_data_file(self.data_file, self.data_file)
+		if self.link_mirror != None:
+			self.link_mirror.close()
+		print u'libeyelink: closing eyelink'
+		pylink.getEYELINK().close()
+		self.wait_for_condition(lambda: not self.connected(), 100, \
+			u'close_connection')
+		self.invalidate_tracker_state()
+		# libeyelink stays loaded between experiments, so make sure that the
+		# next experiment opens a new connection
+		_eyelink = None
+		_graphics = None
+		for label, durations in self.wait_times.items():
+			print u'libeyelink: %s waited %.1f ms on average (max %.1f ms, n=%d)' \
+				% (label, sum(durations) / len(durations), max(durations), \
+				len(durations))
+
+	def receive_data_file(self, src, dest, progress=None):
+
+		"""<DOC>
+		Receives a data file from the tracker. The transfer runs on a worker #
+		thread, while progress is reported on the main thread. The received #
+		size is checked against the size reported by the tracker, the transfer #
+		is repeated if necessary, and an MD5 checksum is written to #
+		[dest].md5.
+
+		Arguments:
+		src			--	The name of the file on the tracker.
+		dest		--	The name of the local file.
+
+		Keyword arguments:
+		progress	--	A function that is called regularly with the number #
+						of bytes received and the elapsed time in #
+						milliseconds, or None to show the progress on the #
+						display. (default=None)
+
+		Returns:
+		An edf_transfer object that describes the transfer.
+		</DOC>"""
+
+		transfer = edf_transfer(src, dest)
+		transfer.start()
+		return self.wait_for_transfer(transfer, progress)
+
+	def wait_for_transfer(self, transfer, progress=None):
+
+		"""<DOC>
+		Waits until a data-file transfer has finished.
+
+		Arguments:
+		transfer	--	An edf_transfer object.
+
+		Keyword arguments:
+		progress	--	See receive_data_file(). (default=None)
+
+		Returns:
+		The edf_transfer object.
+		</DOC>"""
+
+		if progress == None:
+			progress = self.show_transfer_progress
+		t0 = self.experiment.time()
+		while not transfer.done():
+			progress(transfer.received(), self.experiment.time() - t0)
+			self.experiment.sleep(250)
+		if transfer.success():
+			print u'libeyelink: received %s (%d bytes, md5 %s)' % \
+				(transfer.dest, transfer.size, transfer.checksum)
+		else:
+			print u'libeyelink: failed to receive %s after %d attempt(s): %s' \
+				% (transfer.src, transfer.attempts, transfer.error)
+		return transfer
+
+	def wait_for_transfers(self, progress=None):
+
+		"""<DOC>
+		Waits until all data files that are received in the background, #
+		after rotate_data_file(), have been received.
+
+		Keyword arguments:
+		progress	--	See receive_data_file(). (default=None)
+		</DOC>"""
+
+		while len(self.transfers) > 0:
+			self.wait_for_transfer(self.transfers.pop(0), progress)
+
+	def finish_transfers(self, delay=500):
+
+		"""
+		Waits until background transfers have finished. pylink cannot be #
+		used by two threads at once, so this is called before every other use #
+		of the link. Usually the transfer has finished by then, but if the #
+		wait is longer than a short delay, progress is shown, so that the #
+		display does not appear frozen.
+
+		Keyword arguments:
+		delay -- the wait in milliseconds after which progress is shown #
+				 (default=500)
+		"""
+
+		def progress(received, elapsed):
+			if elapsed >= delay:
+				self.show_transfer_progress(received, elapsed)
+
+		if len(self.transfers) > 0:
+			self.wait_for_transfers(progress=progress)
+
+	def rotate_data_file(self):
+
+		"""<DOC>
+		Closes the current data file and opens a new one, for example at the #
+		end of a block. The closed file is received in the background, so #
+		that it can be transferred during a break screen. Background #
+		transfers are completed before the link is used again. The new file #
+		is named by block_file_name(). Block numbers for which a data file #
+		already exists locally or is pending in the transfer manifest, for #
+		example from an earlier run with the same logfile, are skipped, so #
+		that no data file is overwritten.
+
+		Returns:
+		The name of the new data file.
+
+		Exceptions:
+		Raises an exceptions.runtime_error when called during a trial.
+		</DOC>"""
+
+		if self.recording:
+			raise exceptions.runtime_error( \
+				u'Trying to rotate the data file after recording has started')
+		block_nr = self.block_nr + 1
+		while self.data_file_taken(self.block_file_name(block_nr)):
+			block_nr += 1
+		new_file = self.block_file_name(block_nr)
+		self.finish_transfers()
+		if self.tracker_recording:
+			self.stop_tracker_recording()
+		pylink.getEYELINK().closeDataFile()
+		closed_file = self.data_file
+		self.block_nr = block_nr
+		self.data_file = new_file
+		pylink.getEYELINK().openDataFile(self.data_file)
+		print u'libeyelink: continuing in %s' % self.data_file
+		if self.pending_manifest != None:
+			add_pending_file(self.pending_manifest, closed_file, closed_file)
+		else:
+			transfer = edf_transfer(closed_file, closed_file)
+			transfer.start()
+			self.transfers.append(transfer)
+		return self.data_file
+
+	def data_file_taken(self, data_file):
 
-		"""<DOC>
-		Starts recording of gaze samples.
+		"""
+		Checks whether receiving a data file would overwrite another one.
 
-		Exceptions:
-		Raises an exceptions.runtime_error on failure.
-		</DOC>"""
+		Arguments:
+		data_file	--	The name of the data file.
 
-		self.recording = True
-		i = 0
-		while True:
-			# Params: write  samples, write event, send samples, send events
-			error = pylink.getEYELINK().startRecording(1, 1, 1, 1)
-			if not error:
-				break
-			if i > self.MAX_TRY:
-				raise exceptions.runtime_error( \
-					u'Failed to start recording (startRecording error)')
-			i += 1
-			print u'libeyelink.start_recording(): failed to start recording (attempt %d of %d)' \
-				% (i, self.MAX_TRY)
-			pylink.msecDelay(100)
-		# Don't know what this is
-		pylink.pylink.beginRealTimeMode(100)
-		# Wait for a bit until samples start coming in (I think?)
-		if not pylink.getEYELINK().waitForBlockStart(100, 1, 0):
-			raise exceptions.runtime_error( \
-				u'Failed to start recording (waitForBlockStart error)')
+		Returns:
+		True if a file with this name exists locally or is pending in the #
+		transfer manifest, False otherwise.
+		"""
 
-	def stop_recording(self):
+		return os.path.exists(data_file) or (self.pending_manifest != None \
+			and is_pending(self.pending_manifest, data_file))
+
+	def block_file_name(self, block_nr):
 
 		"""<DOC>
-		Stops recording of gaze samples.
+		Gets the name of the data file of a block, as [stem]B[nr].edf. If #
+		this name is longer than 8 characters, the stem is shortened from the #
+		front, because participants are usually told apart by the end of the #
+		stem (as in subject1 and subject2).
+
+		Arguments:
+		block_nr	--	The block number.
+
+		Returns:
+		The file name.
 		</DOC>"""
 
-		self.recording = False
-		pylink.endRealTimeMode()
-		pylink.getEYELINK().setOfflineMode()
-		pylink.msecDelay(500)
+		suffix = u'B%02d' % block_nr
+		stem = self.data_file_stem
+		if len(stem) + len(suffix) > 8:
+			stem = stem[len(stem) + len(suffix) - 8:]
+		return stem + suffix + u'.edf'
 
-	def close(self):
+	def show_transfer_progress(self, received, elapsed):
 
-		"""<DOC>
-		Closes the connection with the eyelink.
-		</DOC>"""
+		"""
+		Shows the progress of a data-file transfer on the display.
 
-		if self.recording:
-			self.stop_recording()
-		# Close the datafile and transfer it to the experimental pc
-		print u'libeyelink: closing data file'
-		pylink.getEYELINK().closeDataFile()
-		pylink.msecDelay(100)
-		print u'libeyelink: transferring data file'
-		pylink.getEYELINK().receiveDataFile(self.data_file, self.data_file)
-		pylink.msecDelay(100)
-		print u'libeyelink: closing eyelink'
-		pylink.getEYELINK().close()
-		pylink.msecDelay(100)
+		Arguments:
+		received	--	The number of bytes received.
+		elapsed		--	The elapsed time in milliseconds.
+		"""
+
+		try:
+			c = canvas(self.experiment)
+			c.text(u'Transferring eye-tracking data ... %.1f MB (%d s)' % \
+				(received / 1e6, elapsed / 1000))
+			c.show()
+		except Exception:
+			# The display may already be unavailable during clean-up
+			pass
 
 	def set_eye_used(self):
 
@@ -564,15 +1904,19 @@ class libeyelink:
 		Raises an exceptions.runtime_error on failure.
 		<DOC>"""
 
-		self.eye_used = pylink.getEYELINK().eyeAvailable()
-		if self.eye_used == self.right_eye:
-			self.log_var("eye_used", "right")
-		elif self.eye_used == self.left_eye or self.eye_used == self.binocular:
-			self.log_var("eye_used", "left")
-			self.eye_used = self.left_eye
-		else:
+		eye_used = pylink.getEYELINK().eyeAvailable()
+		if eye_used == self.binocular:
+			eye_used = self.left_eye
+		if eye_used not in [self.left_eye, self.right_eye]:
 			raise exceptions.runtime_error( \
 				u'Failed to determine which eye is being recorded')
+		# Only log the eye when it changes
+		if eye_used != self.eye_used:
+			if eye_used == self.right_eye:
+				self.log_var("eye_used", "right")
+			else:
+				self.log_var("eye_used", "left")
+		self.eye_used = eye_used
 
 	def sample(self):
 
@@ -592,16 +1936,110 @@ class libeyelink:
 				u'Please start recording before collecting eyelink data')
 		if self.eye_used == None:
 			self.set_eye_used()
-		s = pylink.getEYELINK().getNewestSample()
+		if self.drain_link:
+			self.drain_link_data()
+		s = self.get_newest_sample()
+		gaze = self.sample_gaze(s)
+		if self.drift_estimator == None or s == None:
+			return gaze
+		self.drift_estimator.add_sample(s.getTime(), gaze[0], gaze[1])
+		return self.drift_estimator.correct(gaze[0], gaze[1])
+
+	def correct_gaze(self, pos):
+
+		"""<DOC>
+		Corrects a gaze position for the drift that has been estimated #
+		online. Without drift estimation, the position is returned unchanged.
+
+		Arguments:
+		pos		--	An (x, y) tuple.
+
+		Returns:
+		A corrected (x, y) tuple.
+		</DOC>"""
+
+		if self.drift_estimator == None:
+			return pos
+		return self.drift_estimator.correct(pos[0], pos[1])
+
+	def add_fixation_target(self, x, y):
+
+		"""<DOC>
+		Registers a position at which the participant is expected to #
+		fixate, such as a fixation dot or a saccade target. Fixations near #
+		registered targets are used to estimate drift, if drift estimation #
+		has been enabled.
+
+		Arguments:
+		x		--	The x coordinate of the target.
+		y		--	The y coordinate of the target.
+		</DOC>"""
+
+		if self.drift_estimator != None and (x, y) not in \
+			self.drift_estimator.targets:
+			self.drift_estimator.targets.append((x, y))
+
+	def clear_fixation_targets(self):
+
+		"""<DOC>
+		Removes all registered fixation targets.
+		</DOC>"""
+
+		if self.drift_estimator != None:
+			self.drift_estimator.targets = []
+
+	def estimated_drift(self):
+
+		"""<DOC>
+		Gets the drift that has been estimated online.
+
+		Returns:
+		The average distance in pixels between recent fixations and their #
+		targets, before correction, or 0 if drift is not estimated.
+		</DOC>"""
+
+		if self.drift_estimator == None:
+			return 0
+		return self.drift_estimator.error
+
+	def drift_correction_needed(self, threshold=30):
+
+		"""<DOC>
+		Checks whether the drift is too large to be corrected online, so #
+		that drift correction by the tracker is needed. Without drift #
+		estimation, this is always the case.
+
+		Keyword arguments:
+		threshold	--	The maximum estimated drift in pixels. (default=30)
+
+		Returns:
+		True if drift correction is needed, False otherwise.
+		</DOC>"""
+
+		if self.drift_estimator == None or \
+			self.drift_estimator.fixations == 0:
+			return True
+		return self.drift_estimator.error > threshold
+
+	def sample_gaze(self, s):
+
+		"""<DOC>
+		Gets the gaze position of the recorded eye from a sample.
+
+		Arguments:
+		s		--	A sample, as returned by getNewestSample(), or None.
+
+		Returns:
+		A tuple (x, y). The value (-1, -1) indicates missing data.
+		</DOC>"""
+
 		if s == None:
-			gaze = -1, -1
-		elif self.eye_used == self.right_eye and s.isRightSample():
-			gaze = s.getRightEye().getGaze()
-		elif self.eye_used == self.left_eye and s.isLeftSample():
-			gaze = s.getLeftEye().getGaze()
-		else:
-			gaze = -1, -1
-		return gaze
+			return -1, -1
+		if self.eye_used == self.right_eye and s.isRightSample():
+			return s.getRightEye().getGaze()
+		if self.eye_used == self.left_eye and s.isLeftSample():
+			return s.getLeftEye().getGaze()
+		return -1, -1
 
 	def pupil_size(self):
 
@@ -610,7 +2048,8 @@ class libeyelink:
 
 		Returns:
 		A float corresponding to the pupil size (in arbitrary units). The #
-		value -1 indicates missing data.
+		value -1 indicates missing data, or a link data profile without #
+		pupil size.
 
 		Exceptions:
 		Raises an exceptions.runtime_error on failure.
@@ -619,9 +2058,13 @@ class libeyelink:
 		if not self.recording:
 			raise exceptions.runtime_error( \
 				u'Please start recording before collecting eyelink data')
+		if not self.link_has_pupil:
+			return -1
 		if self.eye_used == None:
 			self.set_eye_used()
-		s = pylink.getEYELINK().getNewestSample()
+		if self.drain_link:
+			self.drain_link_data()
+		s = self.get_newest_sample()
 		if s == None:
 			ps = -1
 		elif self.eye_used == self.right_eye and s.isRightSample():
@@ -657,9 +2100,11 @@ class libeyelink:
 		while True:
 			d = 0
 			while d != event:
-				d = pylink.getEYELINK().getNextData()
+				d = self.get_next_data()
+				if d != 0 and self.drain_link:
+					self.handle_link_data(d, self.get_float_data())
 			# ignore d if its event occured before t_0:
-			float_data = pylink.getEYELINK().getFloatData()
+			float_data = self.get_float_data()
 			if float_data.getTime() - self.get_eyelink_clock_async() > t_0:
 				break
 		return float_data.getTime() - self.get_eyelink_clock_async(), float_data
@@ -677,7 +2122,7 @@ class libeyelink:
 		</DOC>"""
 
 		t, d = self.wait_for_event(pylink.STARTSACC)
-		return t, d.getStartGaze()
+		return t, self.correct_gaze(d.getStartGaze())
 
 	def __wait_for_saccade_start_pre_10028(self):
 
@@ -705,7 +2150,8 @@ class libeyelink:
 		</DOC>"""
 
 		t, d = self.wait_for_event(pylink.ENDSACC)
-		return t, d.getStartGaze(), d.getEndGaze()
+		return t, self.correct_gaze(d.getStartGaze()), \
+			self.correct_gaze(d.getEndGaze())
 
 	def wait_for_fixation_start(self):
 
@@ -720,7 +2166,7 @@ class libeyelink:
 		</DOC>"""
 
 		t, d = self.wait_for_event(pylink.STARTFIX)
-		return t, d.getStartGaze()
+		return t, self.correct_gaze(d.getStartGaze())
 
 
 	def wait_for_fixation_end(self):
@@ -737,7 +2183,10 @@ class libeyelink:
 		</DOC>"""
 
 		t, d = self.wait_for_event(pylink.ENDFIX)
-		return t, d.getStartGaze(), d.getEndGaze()
+		if self.drift_estimator != None:
+			self.drift_estimator.add_fixation(*d.getAverageGaze())
+		return t, self.correct_gaze(d.getStartGaze()), \
+			self.correct_gaze(d.getEndGaze())
 
 	def wait_for_blink_start(self):
 
@@ -782,17 +2231,19 @@ class libeyelink:
 		False if no confirmation was given.
 		"""
 		
-		# Display the confirmation screen
-		conf_canvas = canvas(self.experiment)
+		# Display the confirmation screen. The screen is rendered only once per
+		# session.
+		if self.conf_canvas is None:
+			self.conf_canvas = canvas(self.experiment)
+			yc = self.conf_canvas.ycenter()
+			ld = 40
+			self.conf_canvas.text(u'Really abort experiment?', y=yc-3*ld)
+			self.conf_canvas.text(u'Press \'Y\' to abort', y=yc-0.5*ld)
+			self.conf_canvas.text( \
+				u'Press any other key or wait 5s to go to setup', \
+				y = yc+0.5*ld)
 		conf_kb = keyboard(self.experiment, timeout=None)
-		yc = conf_canvas.ycenter()
-		ld = 40
-		conf_canvas.clear()
-		conf_canvas.text(u'Really abort experiment?', y=yc-3*ld)
-		conf_canvas.text(u'Press \'Y\' to abort', y=yc-0.5*ld)
-		conf_canvas.text(u'Press any other key or wait 5s to go to setup', \
-			y = yc+0.5*ld)
-		conf_canvas.show()
+		self.conf_canvas.show()
 		# process the response:
 		try:
 			key, time = conf_kb.get_key(timeout=5000)
@@ -903,7 +2354,7 @@ class libeyelink_dummy:
 
 	"""A dummy class to keep things running if there is no tracker attached."""
 
-	def __init__(self, experiment, resolution, data_file="default.edf", fg_color=(255, 255, 255), bg_color=(0, 0, 0), saccade_velocity_threshold=35, saccade_acceleration_threshold=9500):
+	def __init__(self, experiment, resolution, data_file="default.edf", fg_color=(255, 255, 255), bg_color=(0, 0, 0), saccade_velocity_threshold=35, saccade_acceleration_threshold=9500, force_drift_correct=False, link_profile=u'full', file_sample_data=u'GAZE,AREA,GAZERES,STATUS,HTARGET', file_event_filter=u'FIXATION,SACCADE,BLINK,MESSAGE,BUTTON', continuous_recording=False, pending_manifest=None, mirror_file=None, drift_estimation=False):
 
 		"""Initializes the eyelink dummy object"""
 
@@ -925,7 +2376,7 @@ class libeyelink_dummy:
 		else:
 			self.blinkfun = True
 
-	def send_command(self, cmd):
+	def send_command(self, cmd, force=False):
 
 		"""Dummy command"""
 
@@ -937,6 +2388,12 @@ class libeyelink_dummy:
 
 		print 'libeyelink.log(): %s' % msg
 
+	def invalidate_tracker_state(self):
+
+		"""Dummy tracker-state invalidation"""
+
+		pass
+
 	def log_var(self, var, val):
 
 		"""Dummy variable logging"""
@@ -955,7 +2412,9 @@ class libeyelink_dummy:
 
 		return True
 
-	def calibrate(self, beep=True, target_size=16):
+	def calibrate(self, beep=True, target_size=16, auto_pacing=False, \
+		pacing_interval=1000, max_validation_error=0.5, participant=None, \
+		profile_file=None, max_profile_age=60):
 
 		"""Dummy calibration"""
 
@@ -1002,7 +2461,7 @@ class libeyelink_dummy:
 
 		pass
 
-	def fix_triggered_drift_correction(self, pos = None, min_samples = 30, max_dev = 60, reset_threshold = 10):
+	def fix_triggered_drift_correction(self, pos = None, min_samples = 30, max_dev = 60, reset_threshold = 10, window = 30, max_outliers = 2):
 
 		"""Dummy drift correction (fixation triggered)"""
 
@@ -1014,10 +2473,13 @@ class libeyelink_dummy:
 		self.prepare_drift_correction(pos)
 		my_keyboard = keyboard(self.experiment, keylist=["escape", "q"], timeout=0)
 
-		# loop until we have sufficient samples
-		lx = []
-		ly = []
-		while len(lx) < min_samples:
+		# the mouse has no sample clock, so the experiment time is used instead
+		fixation = running_window(max(min_samples, 2 * window + 1), window, pos)
+		fixation_start = None
+		fixation_samples = 0
+		outliers = 0
+		last_sample = None
+		while True:
 
 			# pressing escape enters the calibration screen
 			if my_keyboard.get_key()[0] != None:
@@ -1026,33 +2488,34 @@ class libeyelink_dummy:
 				print("libeyelink.fix_triggered_drift_correction(): 'q' pressed")
 				return False
 
-			# collect a sample
+			# collect a new sample
+			t = self.experiment.time()
 			x, y = self.sample()
-
-			if len(lx) == 0 or x != lx[-1] or y != ly[-1]:
-
-				# if present sample deviates too much from previous sample, reset counting
-				if len(lx) > 0 and (abs(x - lx[-1]) > reset_threshold or abs(y - ly[-1]) > reset_threshold):
-					lx = []
-					ly = []
-
-				# collect samples
-				else:
-					lx.append(x)
-					ly.append(y)
-
-			if len(lx) == min_samples:
-
-				avg_x = sum(lx) / len(lx)
-				avg_y = sum(ly) / len(ly)
-				d = ((avg_x - pos[0]) ** 2 + (avg_y - pos[1]) ** 2)**0.5
-
-				if d < max_dev:
+			if (t, x, y) == last_sample:
+				continue
+			last_sample = t, x, y
+
+			# ignore deviating samples, unless there are too many in a row
+			if len(fixation) > 0:
+				mx, my = fixation.mean()
+				if abs(x - mx) > reset_threshold or abs(y - my) > reset_threshold:
+					outliers += 1
+					if outliers > max_outliers:
+						fixation.clear()
+						outliers = 0
+					continue
+			outliers = 0
+			if len(fixation) == 0:
+				fixation_start = t
+				fixation_samples = 0
+			fixation.push(t, x, y)
+			fixation_samples += 1
+
+			if fixation_samples >= min_samples and t - fixation_start >= window:
+				avg_x, avg_y = fixation.mean()
+				if math.hypot(avg_x - pos[0], avg_y - pos[1]) <= max_dev:
 					self.simulator.set_visible(visible=False)
 					return True
-				else:
-					lx = []
-					ly = []
 
 	def start_recording(self):
 
@@ -1062,6 +2525,12 @@ class libeyelink_dummy:
 		self.recording = True
 		print 'libeyelink.start_recording(): recording started'
 
+	def warm_up(self):
+
+		"""Dummy warm-up"""
+
+		pass
+
 	def stop_recording(self):
 
 		"""Stop dummy recording"""
@@ -1070,6 +2539,13 @@ class libeyelink_dummy:
 		self.recording = False
 		print 'libeyelink.stop_recording(): recording stopped'
 
+	def rotate_data_file(self):
+
+		"""Dummy data-file rotation"""
+
+		print 'libeyelink.rotate_data_file(): data file would now be rotated'
+		return self.data_file
+
 	def close(self):
 
 		"""Start dummy recording"""
@@ -1102,6 +2578,48 @@ class libeyelink_dummy:
 
 		return self.simulator.get_pos()[0]
 
+	def enable_quality_monitor(self):
+
+		"""Dummy quality monitor"""
+
+		pass
+
+	def recording_quality(self):
+
+		"""Dummy data quality"""
+
+		return None
+
+	def correct_gaze(self, pos):
+
+		"""Dummy gaze correction"""
+
+		return pos
+
+	def add_fixation_target(self, x, y):
+
+		"""Dummy fixation target"""
+
+		pass
+
+	def clear_fixation_targets(self):
+
+		"""Dummy fixation targets"""
+
+		pass
+
+	def estimated_drift(self):
+
+		"""Dummy drift estimate"""
+
+		return 0
+
+	def drift_correction_needed(self, threshold=30):
+
+		"""Dummy drift check"""
+
+		return True
+
 	def pupil_size(self):
 
 		"""Dummy pupil size"""
@@ -1275,6 +2793,156 @@ class libeyelink_dummy:
 	def set_backdrop(self, backdrop):
 		pass
 
+class camera_renderer:
+
+	"""
+	Converts camera frames to images on a worker thread, so that slow frames do
+	not hold up pylink's tracker-setup loop. Only the newest frame is kept: a
+	raw frame that arrives before the previous one has been converted, or a
+	converted frame that is replaced before it has been shown, is dropped.
+	"""
+
+	def __init__(self, experiment, size, tmp_file, max_fps=30):
+
+		"""
+		Constructor
+
+		Arguments:
+		experiment -- opensesame experiment
+		size -- the (width, height) of the camera image
+		tmp_file -- the file that converted frames are written to
+
+		Keyword arguments:
+		max_fps -- the maximum rate at which frames are presented (default=30)
+		"""
+
+		self.experiment = experiment
+		self.size = size
+		self.tmp_file = tmp_file
+		self.min_interval = 1000. / max_fps
+		self.lock = threading.Lock()
+		self.frame_available = threading.Event()
+		self.raw_frame = None
+		self.ready_frame = None
+		self.running = False
+		self.thread = None
+		self.last_present = None
+		self.t_start = None
+		self.presented = 0
+		self.dropped = 0
+
+	def start(self):
+
+		"""Starts the worker thread"""
+
+		if self.running:
+			return
+		self.running = True
+		self.t_start = self.experiment.time()
+		self.thread = threading.Thread(target=self._work)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+
+		"""Stops the worker thread and discards pending frames"""
+
+		if not self.running:
+			return
+		self.running = False
+		self.frame_available.set()
+		self.thread.join(1.)
+		self.thread = None
+		with self.lock:
+			self.raw_frame = None
+			self.ready_frame = None
+
+	def submit(self, frame):
+
+		"""
+		Hands a completed frame to the worker thread
+
+		Arguments:
+		frame -- the frame as an RGBX string
+		"""
+
+		with self.lock:
+			if self.raw_frame is not None:
+				self.dropped += 1
+			self.raw_frame = frame
+		self.frame_available.set()
+
+	def present(self, my_canvas):
+
+		"""
+		Shows the newest converted frame, unless no new frame is available or
+		the previous frame was shown less than 1/max_fps ago.
+
+		Arguments:
+		my_canvas -- the canvas to show the frame on
+
+		Returns:
+		True if a frame was shown, False otherwise
+		"""
+
+		t = self.experiment.time()
+		if self.last_present is not None and \
+			t - self.last_present < self.min_interval:
+			return False
+		with self.lock:
+			if self.ready_frame is None:
+				return False
+			self.ready_frame = None
+			my_canvas.clear()
+			my_canvas.image(self.tmp_file, scale=2.)
+		my_canvas.show()
+		self.last_present = t
+		self.presented += 1
+		return True
+
+	def fps(self):
+
+		"""
+		Returns:
+		The average presentation rate in frames per second
+		"""
+
+		if self.t_start is None:
+			return 0.
+		dt = self.experiment.time() - self.t_start
+		if dt <= 0:
+			return 0.
+		return 1000. * self.presented / dt
+
+	def _work(self):
+
+		"""The worker thread"""
+
+		global Image
+		if Image == None:
+			try:
+				import Image
+			except:
+				from PIL import Image
+		while True:
+			self.frame_available.wait()
+			self.frame_available.clear()
+			if not self.running:
+				break
+			with self.lock:
+				frame = self.raw_frame
+				self.raw_frame = None
+			if frame is None:
+				continue
+			img = Image.new("RGBX", self.size)
+			img.fromstring(frame)
+			img = pygame.image.fromstring(img.tostring(), self.size, "RGBX")
+			with self.lock:
+				if self.ready_frame is not None:
+					self.dropped += 1
+				pygame.image.save(img, self.tmp_file)
+				self.ready_frame = self.tmp_file
+
 class eyelink_graphics(custom_display):
 
 	"""
@@ -1313,6 +2981,39 @@ class eyelink_graphics(custom_display):
 		self.pal = None
 		self.size = (0,0)
 		self.tmp_file = os.path.join(tempfile.gettempdir(), '__eyelink__.jpg')
+		self.renderer = None
+		self.camera_stats = None
+
+		# Fixed screens are rendered only once, and calibration targets are
+		# rendered the first time that they are drawn, so that showing them
+		# later on only requires a single flip.
+		self.prepare_canvases()
+		self.target_pool = {}
+
+		# Maps key names onto (key input, state) tuples, where the key input is
+		# what is returned by get_input_key(). A state of False indicates that
+		# the key does not change the state.
+		self.input_sleep = 2
+		self.key_queue = []
+		self.auto_pacing = False
+		self.max_validation_error = None
+		self.validation_result = None
+		self.no_key = [pylink.KeyInput(0, pygame.KMOD_NONE)]
+		self.key_table = {}
+		for key, keycode, state in [
+			("return", pylink.ENTER_KEY, None),
+			("space", ord(" "), False),
+			("q", pylink.ESC_KEY, None),
+			("escape", pylink.ESC_KEY, None),
+			("c", ord("c"), "calibration"),
+			("v", ord("v"), "validation"),
+			("a", ord("a"), False),
+			("up", pylink.CURS_UP, False),
+			("down", pylink.CURS_DOWN, False),
+			("left", pylink.CURS_LEFT, False),
+			("right", pylink.CURS_RIGHT, False)]:
+			self.key_table[key] = [pylink.KeyInput(keycode, \
+				pygame.KMOD_NONE)], state
 
 		self.set_tracker(tracker)
 		self.last_mouse_state = -1
@@ -1336,29 +3037,64 @@ class eyelink_graphics(custom_display):
 			self.tracker.sendCommand("autothreshold_repeat=YES")
 			self.tracker.sendCommand("enable_camera_position_detect=YES")
 
+	def text_canvas(self, lines):
+
+		"""
+		Creates a canvas with lines of text
+
+		Arguments:
+		lines -- a list of (text, y) tuples, where y is the vertical offset #
+				 from the display center
+
+		Returns:
+		A canvas
+		"""
+
+		c = canvas(self.experiment)
+		yc = c.ycenter()
+		for text, y in lines:
+			c.text(text, y = yc + y)
+		return c
+
+	def prepare_canvases(self):
+
+		"""Renders the menu and message screens"""
+
+		ld = 40
+		self.canvas_pool = {}
+		self.canvas_pool["blank"] = canvas(self.experiment)
+		self.canvas_pool["menu"] = self.text_canvas([
+			("OpenSesame eyelink plug-in", -5 * ld),
+			("Enter: Enter camera set-up", -3 * ld),
+			("C: Calibration", -2 * ld),
+			("V: Validation", -1 * ld),
+			("Q: Exit set-up", 0 * ld),
+			("A: Automatically adjust threshold", 1 * ld),
+			("Up/ Down: Adjust threshold", 2 * ld),
+			("Left/ Right: Switch camera view", 3 * ld)])
+		self.canvas_pool["cal_error"] = self.text_canvas([
+			("Calibration unsuccessfull", -20),
+			("Press 'Enter' to return to menu", 20)])
+		self.canvas_pool["cal_good_calibration"] = self.text_canvas([
+			("Success!", -20),
+			("Press 'v' to validate", 20)])
+		self.canvas_pool["cal_good_validation"] = self.text_canvas([
+			("Success!", -20),
+			("Press 'Enter' to return to menu", 20)])
+		self.canvas_pool["cal_good"] = self.text_canvas([
+			("Press 'Enter' to return to menu", 0)])
+
 	def setup_cal_display (self):
 
 		"""Setup the calibration display, which contains some instructions"""
 
-		yc = self.my_canvas.ycenter()
-		ld = 40
-		self.my_canvas.clear()
-		self.my_canvas.text("OpenSesame eyelink plug-in", y = yc - 5 * ld)
-		self.my_canvas.text("Enter: Enter camera set-up", y = yc - 3 * ld)
-		self.my_canvas.text("C: Calibration", y = yc - 2 * ld)
-		self.my_canvas.text("V: Validation", y = yc - 1 * ld)
-		self.my_canvas.text("Q: Exit set-up", y = yc - 0 * ld)
-		self.my_canvas.text("A: Automatically adjust threshold", y = yc + 1 * ld)
-		self.my_canvas.text("Up/ Down: Adjust threshold", y = yc + 2 * ld)
-		self.my_canvas.text("Left/ Right: Switch camera view", y = yc + 3 * ld)
-		self.my_canvas.show()
+		self.canvas_pool["menu"].show()
 
 	def exit_cal_display(self):
 
 		"""Clear the display"""
 
-		self.my_canvas.clear()
-		self.my_canvas.show()
+		self.canvas_pool["blank"].show()
 
 	def record_abort_hide(self):
 
@@ -1370,8 +3106,7 @@ class eyelink_graphics(custom_display):
 
 		"""Clear the display"""
 
-		self.my_canvas.clear()
-		self.my_canvas.show()
+		self.canvas_pool["blank"].show()
 
 
 	def erase_cal_target(self):
@@ -1380,6 +3115,29 @@ class eyelink_graphics(custom_display):
 
 		pass
 
+	def target_canvas(self, x, y):
+
+		"""
+		Gets the canvas with the calibration target, rendering it only the #
+		first time that a target is requested at a given position
+
+		Arguments:
+		x -- the x-coordinate of the target
+		y -- the y-coordinate of the target
+
+		Returns:
+		A canvas
+		"""
+
+		r = self.experiment.eyelink.cal_target_size
+		key = x, y, r
+		if key not in self.target_pool:
+			c = canvas(self.experiment)
+			c.circle(x, y, r=r, fill=True)
+			c.circle(x, y, r=2, color=self.experiment.background, fill=True)
+			self.target_pool[key] = c
+		return self.target_pool[key]
+
 	def draw_cal_target(self, x, y):
 
 		"""
@@ -1390,11 +3148,7 @@ class eyelink_graphics(custom_display):
 		y -- the y-coordinate of the target
 		"""
 
-		self.my_canvas.clear()
-
-		self.my_canvas.circle(x, y, r=self.experiment.eyelink.cal_target_size, fill=True)
-		self.my_canvas.circle(x, y, r=2, color=self.experiment.background, fill=True)
-		self.my_canvas.show()
+		self.target_canvas(x, y).show()
 		if self.experiment.eyelink.cal_beep:
 			self.play_beep(pylink.CAL_TARG_BEEP)
 
@@ -1410,26 +3164,72 @@ class eyelink_graphics(custom_display):
 		if beepid == pylink.CAL_TARG_BEEP:
 			self.__target_beep__.play()
 		elif beepid == pylink.CAL_ERR_BEEP or beepid == pylink.DC_ERR_BEEP:
-			self.my_canvas.clear()
-			self.my_canvas.text("Calibration unsuccessfull", y = self.my_canvas.ycenter() - 20)
-			self.my_canvas.text("Press 'Enter' to return to menu", y = self.my_canvas.ycenter() + 20)
-			self.my_canvas.show()
+			self.canvas_pool["cal_error"].show()
 			self.__target_beep__error__.play()
 		elif beepid == pylink.CAL_GOOD_BEEP:
-			self.my_canvas.clear()
 			if self.state == "calibration":
-				self.my_canvas.text("Success!", y = self.my_canvas.ycenter() - 20)
-				self.my_canvas.text("Press 'v' to validate", y = self.my_canvas.ycenter() + 20)
+				self.canvas_pool["cal_good_calibration"].show()
 			elif self.state == "validation":
-				self.my_canvas.text("Success!", y = self.my_canvas.ycenter() - 20)
-				self.my_canvas.text("Press 'Enter' to return to menu", y = self.my_canvas.ycenter() + 20)
+				self.validation_result = self.get_validation_result()
+				self.canvas_pool["cal_good_validation"].show()
 			else:
-				self.my_canvas.text("Press 'Enter' to return to menu")
-			self.my_canvas.show()
+				self.canvas_pool["cal_good"].show()
 			self.__target_beep__done__.play()
+			if self.auto_pacing:
+				self.auto_advance()
 		else: #	DC_GOOD_BEEP	or DC_TARG_BEEP
 			pass
 
+	def set_auto_pacing(self, auto_pacing, max_validation_error=0.5):
+
+		"""
+		Enables or disables auto-paced calibration
+
+		Arguments:
+		auto_pacing -- True to enable auto-pacing, False to disable it
+
+		Keyword arguments:
+		max_validation_error -- the maximum average validation error for set-up #
+								to be left automatically (default=0.5)
+		"""
+
+		self.auto_pacing = auto_pacing
+		self.max_validation_error = max_validation_error
+		self.key_queue = []
+
+	def auto_advance(self):
+
+		"""
+		Queues the keys that move on to the next step of auto-paced set-up: #
+		validation after a successful calibration, and leaving set-up after a #
+		sufficiently accurate validation
+		"""
+
+		if self.state == "calibration":
+			self.key_queue.append("v")
+		elif self.state == "validation" and self.validation_result != None \
+			and self.validation_result[0] <= self.max_validation_error:
+			self.key_queue += ["return", "escape"]
+
+	def get_validation_result(self):
+
+		"""
+		Gets the result of the last validation from the tracker
+
+		Returns:
+		An (average error, maximum error) tuple in degrees, or None if the #
+		result is not available
+		"""
+
+		try:
+			msg = self.tracker.getCalibrationMessage()
+		except:
+			return None
+		m = re.search(r'ERROR\s+([\d.]+)\s+avg\.\s+([\d.]+)\s+max', msg)
+		if m == None:
+			return None
+		return float(m.group(1)), float(m.group(2))
+
 	def getColorFromIndex(self,colorindex):
 
 		"""Unused"""
@@ -1463,47 +3263,46 @@ class eyelink_graphics(custom_display):
 		A list of (keycode, moderator tuples)
 		"""
 
-		try:
-			key, time = self.my_keyboard.get_key()
-		except response_error:
-			key = 'escape'
-			self.experiment.eyelink_esc_pressed = True
-		except:
-			return None
-		
-		if key == "return":
-			keycode = pylink.ENTER_KEY
-			self.state = None
-		elif key == "space":
-			keycode = ord(" ")
-		elif key in ["q", "escape"]:
-			keycode = pylink.ESC_KEY
-			self.state = None
-		elif key == "c":
-			keycode = ord("c")
-			self.state = "calibration"
-		elif key == "v":
-			keycode = ord("v")
-			self.state = "validation"
-		elif key == "a":
-			keycode = ord("a")
-		elif key == "up":
-			keycode = pylink.CURS_UP
-		elif key == "down":
-			keycode = pylink.CURS_DOWN
-		elif key == "left":
-			keycode = pylink.CURS_LEFT
-		elif key == "right":
-			keycode = pylink.CURS_RIGHT
-		else:
-			keycode = 0
+		# Show camera frames that were converted since the last call
+		if self.renderer is not None:
+			self.renderer.present(self.my_canvas)
 
-		return [pylink.KeyInput(keycode, pygame.KMOD_NONE)]
+		# Keys that were queued by auto-pacing take precedence over the
+		# keyboard
+		if len(self.key_queue) > 0:
+			key = self.key_queue.pop(0)
+		else:
+			try:
+				key, time = self.my_keyboard.get_key()
+			except response_error:
+				key = 'escape'
+				self.experiment.eyelink_esc_pressed = True
+			except:
+				return None
+
+		# pylink polls this function continuously during set-up. If no key
+		# was pressed, we briefly yield the CPU instead of spinning.
+		if key == None:
+			self.experiment.sleep(self.input_sleep)
+			return self.no_key
+		if key not in self.key_table:
+			return self.no_key
+		key_input, state = self.key_table[key]
+		if state != False:
+			self.state = state
+		return key_input
 
 	def exit_image_display(self):
 
 		"""Exit the image display"""
 
+		if self.renderer is not None:
+			self.renderer.stop()
+			self.camera_stats = {'fps' : self.renderer.fps(), 'presented' : \
+				self.renderer.presented, 'dropped' : self.renderer.dropped}
+			print 'eyelink_graphics.exit_image_display(): %(fps).1f fps, %(presented)d frames shown, %(dropped)d frames dropped' \
+				% self.camera_stats
+			self.renderer = None
 		self.clear_cal_display()
 
 	def alert_printf(self,msg):
@@ -1526,6 +3325,11 @@ class eyelink_graphics(custom_display):
 		self.clear_cal_display()
 		self.last_mouse_state = -1
 		self.imagebuffer = array.array('l')
+		if self.renderer is not None:
+			self.renderer.stop()
+		self.renderer = camera_renderer(self.experiment, self.size, \
+			self.tmp_file)
+		self.renderer.start()
 
 	def image_title(self, text):
 
@@ -1551,17 +3355,13 @@ class eyelink_graphics(custom_display):
 			except:
 				pass
 
+		# Completed frames are converted on the renderer's worker thread, and
+		# shown at a capped rate. This way, slow frames are dropped instead of
+		# slowing down the tracker-setup loop.
 		if line == totlines:
-			bufferv = self.imagebuffer.tostring()
-			img = Image.new("RGBX", self.size)
-			img.fromstring(bufferv)
-			img = img.resize(self.size)
-			img = pygame.image.fromstring(img.tostring(), self.size, "RGBX")
-			self.my_canvas.clear()
-			pygame.image.save(img, self.tmp_file)
-			self.my_canvas.image(self.tmp_file, scale=2.)
-			self.my_canvas.show()
+			self.renderer.submit(self.imagebuffer.tostring())
 			self.imagebuffer = array.array('l')
+		self.renderer.present(self.my_canvas)
 
 	def set_image_palette(self, r, g, b):
 
@@ -0,0 +1,281 @@
+"""
+This file is part of OpenSesame.
+
+OpenSesame is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+OpenSesame is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with OpenSesame.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Writes and reads link mirror files, which contain the link samples and events
+of a recording in fixed-size records. libeyelink writes them while recording,
+and analysis and monitoring scripts can read them with read_mirror() without
+OpenSesame or pylink.
+"""
+
+import mmap
+import struct
+
+# The pylink data type of samples, so that pylink is not needed to read files
+SAMPLE_TYPE = 200
+
+class link_mirror:
+
+	"""
+	Appends link samples and events to a local file with fixed-size records, #
+	so that the data can be read while the experiment is still running, and #
+	serves as a backup of the EDF file. The file starts with a header that #
+	contains the number of valid records, which is updated after every #
+	record. The file is grown in chunks, and the unused tail is zero-filled.
+
+	The data is read from the link queue of pylink, which is only emptied #
+	when libeyelink reads from the link. If the queue overflows in between, #
+	samples are lost. Such gaps in the sample times are counted in the #
+	header, so that an incomplete file can be recognized.
+
+	Use mirror_dtype() and read_mirror() to read the file as a NumPy memmap, #
+	and mirror_gaps() to get the number of gaps.
+	"""
+
+	MAGIC = b'ELMIRROR'
+	VERSION = 2
+	# magic, version, record size, number of records, number of gaps
+	HEADER = struct.Struct('<8sIIQQ')
+	HEADER_SIZE = 64
+	# type, eye, start time, end time, x, y, pupil size, end x, end y
+	RECORD = struct.Struct('<BBxxIIfffff')
+	CHUNK = 1 << 20
+
+	def __init__(self, path):
+
+		"""
+		Constructor
+
+		Arguments:
+		path -- the path of the mirror file, which is overwritten
+		"""
+
+		self.path = path
+		self.count = 0
+		self.gaps = 0
+		# The time of the last sample, and the shortest interval between
+		# samples, which is the sample interval of the link
+		self.last_time = None
+		self.interval = None
+		self.fd = open(path, u'w+b')
+		self.capacity = 0
+		self.map = None
+		self.grow()
+
+	def grow(self):
+
+		"""Enlarges the file by one chunk and maps it again"""
+
+		if self.map != None:
+			self.map.close()
+		self.capacity += self.CHUNK // self.RECORD.size
+		self.fd.truncate(self.HEADER_SIZE + self.capacity * self.RECORD.size)
+		self.map = mmap.mmap(self.fd.fileno(), self.HEADER_SIZE + \
+			self.capacity * self.RECORD.size)
+		self.HEADER.pack_into(self.map, 0, self.MAGIC, self.VERSION, \
+			self.RECORD.size, self.count, self.gaps)
+
+	def append(self, data_type, eye, start, end=0, x=-1, y=-1, pupil=-1, \
+		end_x=-1, end_y=-1):
+
+		"""
+		Appends a record
+
+		Arguments:
+		data_type -- the pylink data type, such as pylink.SAMPLE_TYPE
+		eye -- the eye
+		start -- the sample time, or the start time of an event
+
+		Keyword arguments:
+		end -- the end time of an event (default=0)
+		x -- the gaze x coordinate, or the start x of an event (default=-1)
+		y -- the gaze y coordinate, or the start y of an event (default=-1)
+		pupil -- the pupil size (default=-1)
+		end_x -- the end x of an event (default=-1)
+		end_y -- the end y of an event (default=-1)
+		"""
+
+		if self.count == self.capacity:
+			self.grow()
+		self.RECORD.pack_into(self.map, self.HEADER_SIZE + self.count * \
+			self.RECORD.size, data_type, eye, start, end, x, y, pupil, end_x, \
+			end_y)
+		# The count is updated after the record, so that readers never see a
+		# partially written record
+		self.count += 1
+		struct.pack_into('<Q', self.map, 16, self.count)
+
+	def record(self, data_type, data):
+
+		"""
+		Appends a sample or event, as returned by getFloatData()
+
+		Arguments:
+		data_type -- the type that was returned by getNextData()
+		data -- the float data
+		"""
+
+		if data_type == SAMPLE_TYPE:
+			self.check_gap(data.getTime())
+			for eye, present, get_eye in [ \
+				(0, data.isLeftSample(), data.getLeftEye), \
+				(1, data.isRightSample(), data.getRightEye)]:
+				if present:
+					e = get_eye()
+					x, y = e.getGaze()
+					self.append(data_type, eye, data.getTime(), x=x, y=y, \
+						pupil=e.getPupilSize())
+			return
+		# Events have different fields, depending on their type
+		start = _float_field(data, u'getStartTime', None)
+		if start == None:
+			start = data.getTime()
+		x, y = _float_field(data, u'getStartGaze', (-1, -1))
+		end_x, end_y = _float_field(data, u'getEndGaze', (-1, -1))
+		self.append(data_type, _float_field(data, u'getEye', 0), start, \
+			end=_float_field(data, u'getEndTime', 0), x=x, y=y, \
+			pupil=_float_field(data, u'getAveragePupilSize', -1), \
+			end_x=end_x, end_y=end_y)
+
+	def check_gap(self, t):
+
+		"""
+		Counts a gap if a sample comes more than twice the sample interval #
+		after the previous one
+
+		Arguments:
+		t -- the sample time
+		"""
+
+		if self.last_time != None and t > self.last_time:
+			interval = t - self.last_time
+			if self.interval != None and interval > 2 * self.interval:
+				self.gaps += 1
+				struct.pack_into('<Q', self.map, 24, self.gaps)
+			if self.interval == None or interval < self.interval:
+				self.interval = interval
+		self.last_time = t
+
+	def pause(self):
+
+		"""
+		Indicates that the tracker has stopped recording, so that the pause #
+		is not counted as a gap
+		"""
+
+		self.last_time = None
+
+	def close(self):
+
+		"""Flushes and closes the file, and trims the unused tail"""
+
+		if self.map == None:
+			return
+		self.map.flush()
+		self.map.close()
+		self.map = None
+		self.fd.truncate(self.HEADER_SIZE + self.count * self.RECORD.size)
+		self.fd.close()
+
+def _float_field(data, name, default):
+
+	"""
+	Gets a field from float data, which depends on the type of event
+
+	Arguments:
+	data -- the float data
+	name -- the name of the getter, such as u'getStartGaze'
+	default -- the value that is returned if the field is not available
+
+	Returns:
+	The field value or the default value
+	"""
+
+	try:
+		return getattr(data, name)()
+	except Exception:
+		return default
+
+def mirror_dtype():
+
+	"""
+	Gets the NumPy dtype of the records in a link mirror file. NumPy is #
+	imported on first use, so that it is not required for recording.
+
+	Returns:
+	A numpy.dtype object.
+	"""
+
+	import numpy
+	return numpy.dtype([(u'type', u'<u1'), (u'eye', u'<u1'), \
+		(u'pad', u'<u2'), (u'start', u'<u4'), (u'end', u'<u4'), \
+		(u'x', u'<f4'), (u'y', u'<f4'), (u'pupil', u'<f4'), \
+		(u'end_x', u'<f4'), (u'end_y', u'<f4')])
+
+def read_mirror(path):
+
+	"""
+	Opens a link mirror file as a read-only NumPy memmap, without copying. #
+	This can be done while the file is still being written, in which case #
+	the memmap contains the records that have been written so far.
+
+	Arguments:
+	path	--	The path of the mirror file.
+
+	Returns:
+	A numpy.memmap with the dtype of mirror_dtype(). The type field is the #
+	pylink data type, such as pylink.SAMPLE_TYPE (200) or pylink.ENDFIX (8).
+
+	Exceptions:
+	Raises a ValueError if the file is not a mirror file.
+	"""
+
+	import numpy
+	with open(path, u'rb') as fd:
+		magic, version, record_size, count, gaps = \
+			link_mirror.HEADER.unpack(fd.read(link_mirror.HEADER.size))
+	dtype = mirror_dtype()
+	if magic != link_mirror.MAGIC or record_size != dtype.itemsize:
+		raise ValueError(u'%s is not a link mirror file' % path)
+	if count == 0:
+		return numpy.zeros(0, dtype=dtype)
+	return numpy.memmap(path, dtype=dtype, mode=u'r', \
+		offset=link_mirror.HEADER_SIZE, shape=(count,))
+
+def mirror_gaps(path):
+
+	"""
+	Gets the number of gaps in the samples of a link mirror file, which #
+	occur when the link queue overflowed because link data was not read for #
+	too long. Pauses in recording are not counted.
+
+	Arguments:
+	path	--	The path of the mirror file.
+
+	Returns:
+	The number of gaps.
+
+	Exceptions:
+	Raises a ValueError if the file is not a mirror file.
+	"""
+
+	with open(path, u'rb') as fd:
+		magic, version, record_size, count, gaps = \
+			link_mirror.HEADER.unpack(fd.read(link_mirror.HEADER.size))
+	if magic != link_mirror.MAGIC:
+		raise ValueError(u'%s is not a link mirror file' % path)
+	return gaps
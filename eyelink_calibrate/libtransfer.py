@@ -0,0 +1,249 @@
+"""
+This file is part of OpenSesame.
+
+OpenSesame is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+OpenSesame is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with OpenSesame.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+"""
+Receives data files from the tracker, and keeps track of data files that are
+left on the tracker in a transfer manifest. This module only depends on pylink,
+so that it can be used outside of OpenSesame, for example by eyelink_fetch.py.
+libeyelink imports everything from here.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+
+try:
+	import pylink
+except ImportError:
+	pylink = None
+
+def connect(address=None):
+
+	"""
+	Opens a connection to the tracker.
+
+	Keyword arguments:
+	address		--	The IP address of the tracker, or None for the default #
+					address. (default=None)
+
+	Returns:
+	A pylink.EyeLink object.
+
+	Exceptions:
+	Raises a RuntimeError on failure.
+	"""
+
+	if pylink == None:
+		raise RuntimeError( \
+			u'Failed to connect to the tracker: pylink is not available')
+	try:
+		if address == None:
+			return pylink.EyeLink()
+		return pylink.EyeLink(address)
+	except Exception as e:
+		raise RuntimeError(u'Failed to connect to the tracker: %s' % e)
+
+def load_manifest(path):
+
+	"""
+	Reads a transfer manifest, which keeps track of data files that are still #
+	on the tracker (pending) and of data files that have been received.
+
+	Arguments:
+	path	--	The path to the manifest.
+
+	Returns:
+	A dict with 'pending' and 'received' keys, each of which is a list of #
+	dicts.
+	"""
+
+	if not os.path.exists(path):
+		return {u'pending' : [], u'received' : []}
+	with open(path) as fd:
+		return json.load(fd)
+
+def save_manifest(path, manifest):
+
+	"""
+	Writes a transfer manifest. See load_manifest().
+
+	Arguments:
+	path		--	The path to the manifest.
+	manifest	--	The manifest dict.
+	"""
+
+	# Write to a temporary file first, so that an interrupted write does not
+	# corrupt the manifest
+	with open(path + u'.tmp', u'w') as fd:
+		json.dump(manifest, fd, indent=1)
+	if os.path.exists(path):
+		os.remove(path)
+	os.rename(path + u'.tmp', path)
+
+def is_pending(path, src):
+
+	"""
+	Checks whether a data file is listed as pending in a transfer manifest. #
+	File names on the tracker are not case sensitive.
+
+	Arguments:
+	path	--	The path to the manifest.
+	src		--	The name of the file on the tracker.
+
+	Returns:
+	True if the file is pending, False otherwise.
+	"""
+
+	return src.lower() in [entry[u'src'].lower() for entry in \
+		load_manifest(path)[u'pending']]
+
+def add_pending_file(path, src, dest):
+
+	"""
+	Adds a data file that is still on the tracker to a transfer manifest.
+
+	Arguments:
+	path	--	The path to the manifest.
+	src		--	The name of the file on the tracker.
+	dest	--	The local path that the file should be received as.
+
+	Exceptions:
+	Raises a ValueError if the file is already pending, because the pending #
+	file has then been overwritten on the tracker.
+	"""
+
+	if is_pending(path, src):
+		raise ValueError(u'%s is already pending in %s' % (src, path))
+	manifest = load_manifest(path)
+	manifest[u'pending'].append({u'src' : src, u'dest' : \
+		os.path.abspath(dest), u'time' : time.time()})
+	save_manifest(path, manifest)
+
+class edf_transfer:
+
+	"""
+	Receives a data file from the tracker on a worker thread. The file is #
+	received under a temporary name, and is only renamed once the size that #
+	is reported by the tracker matches the size on disk. If not, the transfer #
+	is repeated. After a successful transfer, an MD5 checksum of the file is #
+	written to [dest].md5, so that copies can be verified later.
+	"""
+
+	def __init__(self, src, dest, retries=3):
+
+		"""
+		Constructor
+
+		Arguments:
+		src -- the name of the file on the tracker
+		dest -- the name of the local file
+
+		Keyword arguments:
+		retries -- the number of times that a failed transfer is repeated #
+				   (default=3)
+		"""
+
+		self.src = src
+		self.dest = dest
+		self.part = dest + u'.part'
+		self.retries = retries
+		self.attempts = 0
+		self.size = None
+		self.checksum = None
+		self.error = None
+		self.thread = None
+
+	def start(self):
+
+		"""Starts the transfer"""
+
+		self.thread = threading.Thread(target=self._work)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def done(self):
+
+		"""
+		Returns:
+		True if the transfer has finished, successfully or not
+		"""
+
+		return self.thread != None and not self.thread.is_alive()
+
+	def success(self):
+
+		"""
+		Returns:
+		True if the transfer has finished successfully
+		"""
+
+		return self.done() and self.error == None
+
+	def received(self):
+
+		"""
+		Returns:
+		The number of bytes that have been received so far
+		"""
+
+		if self.size != None:
+			return self.size
+		try:
+			return os.path.getsize(self.part)
+		except OSError:
+			return 0
+
+	def _work(self):
+
+		"""The worker thread"""
+
+		while True:
+			self.attempts += 1
+			try:
+				size = pylink.getEYELINK().receiveDataFile(self.src, self.part)
+			except Exception as e:
+				size = None
+				self.error = u'%s' % e
+			else:
+				if size <= 0:
+					self.error = u'receiveDataFile() returned %s' % size
+				elif not os.path.exists(self.part) or \
+					os.path.getsize(self.part) != size:
+					self.error = u'expected %d bytes, received %d' % (size, \
+						os.path.getsize(self.part) if os.path.exists( \
+						self.part) else 0)
+				else:
+					self.error = None
+			if self.error == None:
+				break
+			print u'libeyelink: transfer of %s failed: %s' % (self.src, \
+				self.error)
+			if self.attempts > self.retries:
+				return
+		if os.path.exists(self.dest):
+			os.remove(self.dest)
+		os.rename(self.part, self.dest)
+		md5 = hashlib.md5()
+		with open(self.dest, u'rb') as fd:
+			for block in iter(lambda: fd.read(1 << 20), b''):
+				md5.update(block)
+		self.checksum = md5.hexdigest()
+		with open(self.dest + u'.md5', u'w') as fd:
+			fd.write(u'%s  %s\n' % (self.checksum, os.path.basename(self.dest)))
+		self.size = size
@@ -46,6 +46,14 @@ class eyelink_drift_correct(item.item):
 		self.xpos = 0
 		self.ypos = 0
 
+		# Adaptive drift checks, based on the data quality of the last trial
+		self.adaptive = "no"
+		self.max_track_loss = 10
+		self.max_jitter = 1
+		self.max_drift_error = 1
+		self.max_skips = 4
+		self.skipped = 0
+
 		# Provide a short accurate description of the items functionality
 		self.description = "Drift correction plugin for the Eyelink series of eye trackers (SR-Research)"
 
@@ -56,7 +64,7 @@ class eyelink_drift_correct(item.item):
 
 		"""
 		Prepare the item. In this case this means drawing a fixation
-		dot to an offline canvas.
+		dot to an offline canvas, which is shown by run().
 		"""
 
 		# Pass the word on to the parent
@@ -67,9 +75,60 @@ class eyelink_drift_correct(item.item):
 		if not hasattr(self.experiment, "eyelink"):
 			raise exceptions.runtime_error("Please connect to the eyelink using the the eyelink_calibrate plugin before using any other eyelink plugins")
 
+		try:
+			x = int(self.get("xpos", _eval=True))
+			y = int(self.get("ypos", _eval=True))
+		except:
+			raise exceptions.runtime_error("Please use numeric values for the coordinates in eyelink_drift_correct item '%s'" % self.name)
+
+		if not self.has("coordinates") or self.get("coordinates") == "relative":
+			x += self.get("width") / 2
+			y += self.get("height") / 2
+		self.pos = x, y
+
+		# Draw a fixation cross
+		self.c = openexp.canvas.canvas(self.experiment, self.get("background"), self.get("foreground"))
+		self.c.set_penwidth(3)
+		self.c.line(x - 5, y, x + 5, y)
+		self.c.line(x, y - 5, x, y + 5)
+
+		if self.get("adaptive") == "yes":
+			try:
+				self.thresholds = {
+					"track_loss" : float(self.get("max_track_loss")),
+					"jitter" : float(self.get("max_jitter")),
+					"drift_error" : float(self.get("max_drift_error"))
+					}
+			except:
+				raise exceptions.runtime_error("Please use numeric values for the quality thresholds in eyelink_drift_correct item '%s'" % self.name)
+			self.experiment.eyelink.enable_quality_monitor()
+
 		# Report success
 		return True
 
+	def quality(self):
+
+		"""
+		Rates the data quality of the last trial against the thresholds
+
+		Returns:
+		"good" if all measures are available and within the thresholds, #
+		"poor" if any measure exceeds twice its threshold, and "fair" otherwise
+		"""
+
+		quality = self.experiment.eyelink.recording_quality()
+		if quality == None:
+			return "fair"
+		rating = "good"
+		for name, threshold in self.thresholds.items():
+			if quality[name] == None:
+				rating = "fair"
+			elif quality[name] > 2 * threshold:
+				return "poor"
+			elif quality[name] > threshold:
+				rating = "fair"
+		return rating
+
 	def run(self):
 
 		"""
@@ -79,28 +138,32 @@ class eyelink_drift_correct(item.item):
 
 		self.set_item_onset()
 
-		try:
-			x = int(self.get("xpos", _eval=True))
-			y = int(self.get("ypos", _eval=True))
-		except:
-			raise exceptions.runtime_error("Please use numeric values for the coordinates in eyelink_drift_correct item '%s'" % self.name)
-
-		if not self.has("coordinates") or self.get("coordinates") == "relative":
-			x += self.get("width") / 2
-			y += self.get("height") / 2
-
-		# Draw a fixation cross
-		c = openexp.canvas.canvas(self.experiment, self.get("background"), self.get("foreground"))
-		c.set_penwidth(3)
-		c.line(x - 5, y, x + 5, y)
-		c.line(x, y - 5, x, y + 5)
-		c.show()
+		if self.get("adaptive") == "yes":
+			quality = self.quality()
+			# The drift check is skipped when the last trial was good, but
+			# never more than max_skips times in a row. If the drift is
+			# estimated online, it must also be small enough.
+			if quality == "good" and self.skipped < self.get("max_skips") \
+				and (getattr(self.experiment.eyelink, "drift_estimator", \
+				None) == None or not \
+				self.experiment.eyelink.drift_correction_needed()):
+				self.skipped += 1
+				self.experiment.eyelink.log_var("drift_check", "skipped")
+				return True
+			# When the quality has degraded, a drift check is unlikely to
+			# pass, so recalibrate right away
+			if quality == "poor":
+				self.experiment.eyelink.log_var("drift_check", "recalibrated")
+				self.experiment.eyelink.calibrate()
+			self.skipped = 0
+
+		self.c.show()
 		# Do drift correction
-		while not self.experiment.eyelink.drift_correction( (x, y), \
+		while not self.experiment.eyelink.drift_correction(self.pos, \
 			self.get("mode") == self._mode_auto):
-			
+
 			self.experiment.eyelink.calibrate()
-			c.show()
+			self.c.show()
 
 		# Report success
 		return True
@@ -145,6 +208,23 @@ class qteyelink_drift_correct(eyelink_drift_correct, qtplugin.qtplugin):
 			self.add_line_edit_control("xpos", "X coordinate", 0)
 			self.add_line_edit_control("ypos", "Y coordinate", 0)
 
+		if hasattr(self, 'add_checkbox_control'):
+			self.add_checkbox_control("adaptive", \
+				"Adapt to data quality", \
+				tooltip = "Indicates whether the drift check is skipped when the data quality of the last trial was good, and calibration is repeated right away when it was poor (more than twice a threshold)")
+		else:
+			self.add_combobox_control("adaptive", \
+				"Adapt to data quality", ['yes', 'no'], \
+				tooltip = "Indicates whether the drift check is skipped when the data quality of the last trial was good, and calibration is repeated right away when it was poor (more than twice a threshold)")
+		self.add_line_edit_control("max_track_loss", "Maximum track loss (%)", 10, \
+			tooltip = "The percentage of samples without gaze position above which the data quality is not good")
+		self.add_line_edit_control("max_jitter", "Maximum sample jitter (ms)", 1, \
+			tooltip = "The standard deviation of the sample intervals above which the data quality is not good")
+		self.add_line_edit_control("max_drift_error", "Maximum drift-check error (deg)", 1, \
+			tooltip = "The error of the last drift check above which the data quality is not good")
+		self.add_spinbox_control("max_skips", "Maximum skipped checks in a row", 0, 100, \
+			tooltip = "The number of drift checks that can be skipped in a row, after which a drift check is always done")
+
 		# Add a stretch to the edit_vbox, so that the controls do not
 		# stretch to the bottom of the window.
 		self.edit_vbox.addStretch()
@@ -49,6 +49,8 @@ class eyelink_stop_recording(item.item):
 		
 		if not hasattr(self, "log_msg"):
 			self.log_msg = "stop_trial"
+		if not hasattr(self, "new_data_file"):
+			self.new_data_file = "no"
 						
 	def prepare(self):
 	
@@ -80,6 +82,10 @@ class eyelink_stop_recording(item.item):
 		self.experiment.eyelink.status_msg(self.eval_text(self.get("log_msg")))	
 		self.experiment.eyelink.log(self.eval_text(self.get("log_msg")))	
 		self.experiment.eyelink.stop_recording()
+		# At the end of a block, the data file can be closed and received in
+		# the background, while recording continues in a new file
+		if self.get("new_data_file") == "yes":
+			self.experiment.eyelink.rotate_data_file()
 				
 		# Report success
 		return True
@@ -116,6 +122,10 @@ class qteyelink_stop_recording(eyelink_stop_recording, qtplugin.qtplugin):
 		# Pass the word on to the parent		
 		qtplugin.qtplugin.init_edit_widget(self, False)			
 		self.add_line_edit_control("log_msg", "Log message", default = "stop_trial", tooltip = "A message to write to the eyelink logfile.", min_width = 400)
+		if hasattr(self, 'add_checkbox_control'):
+			self.add_checkbox_control("new_data_file", "Start a new data file (end of block)", tooltip = "Close the EDF file, receive it in the background, and continue in a new file")
+		else:
+			self.add_combobox_control("new_data_file", "Start a new data file (end of block)", ['yes', 'no'], tooltip = "Close the EDF file, receive it in the background, and continue in a new file")
 		
 		# Add a stretch to the edit_vbox, so that the controls do not
 		# stretch to the bottom of the window.